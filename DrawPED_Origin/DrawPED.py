@@ -8,17 +8,24 @@
 @Time        :   2023/12/11 13:17:49
 """
 
-import originpro as op
 import numpy as np
 import os
 import sys
-import matplotlib.pyplot as plt
+import re
+import csv
+import json
+import contextlib
+from array import array
+# matplotlib and originpro are imported by the plot method that needs them
 
 bar_width = 2
 spacing_between_bar = 4
 nbins = 100*spacing_between_bar
 
 class EnergyTagPair(object):
+    """ One pathway: a view into the arrays of a PathwayTable, or a standalone pathway
+        built from an energy list and a tag list. pair[index] gives an EnergyTag.
+    """
     class EnergyTag(object):
         def __init__(self, energy, tag):
             self.energy = energy
@@ -30,14 +37,254 @@ class EnergyTagPair(object):
     def __init__(self, energy_list, tag_list):
         if len(energy_list) != len(tag_list):
             raise ValueError("Energy list and tag list must be of the same length.")
-        self.pairs = [self.EnergyTag(energy, tag) for energy, tag in zip(energy_list, tag_list)]
+        tag_index = {}
+        self.energies = np.asarray(energy_list, dtype=float)
+        self.tag_ids = np.array([tag_index.setdefault(tag, len(tag_index)) for tag in tag_list], dtype=np.int32)
+        self.tag_names = list(tag_index)
+
+    @classmethod
+    def view(cls, energies, tag_ids, tag_names):
+        pair = cls.__new__(cls)
+        pair.energies, pair.tag_ids, pair.tag_names = energies, tag_ids, tag_names
+        return pair
+
+    @property
+    def tags(self):
+        return [self.tag_names[i] for i in self.tag_ids]
+
+    @property
+    def pairs(self):
+        return [self.EnergyTag(energy, tag) for energy, tag in zip(self.energies, self.tags)]
+
+    def __len__(self):
+        return len(self.energies)
 
     def __getitem__(self, index):
-        return self.pairs[index]
+        if isinstance(index, slice):
+            return self.pairs[index]
+        return self.EnergyTag(self.energies[index], self.tag_names[self.tag_ids[index]])
+
+    def __iter__(self):
+        return iter(self.pairs)
 
     def __repr__(self):
         return '[' + ', '.join(repr(pair) for pair in self.pairs) + ']'
 
+class PathwayTable(object):
+    """ All pathways of a PED file in flat arrays: the energies of all pathways one after
+        another, the tag of every point as an index into the interned tag_names, and
+        offsets[k]:offsets[k+1] the points of pathway k. table[k] is its EnergyTagPair.
+    """
+    def __init__(self, energies, tag_ids, tag_names, offsets, legend, color):
+        self.energies = energies
+        self.tag_ids = tag_ids
+        self.tag_names = tag_names
+        self.offsets = offsets
+        self.legend = legend
+        self.color = color
+
+    @classmethod
+    def read_csv(cls, file_name):
+        """ Stream the PED csv: a row 'color,energy,...' followed by a row 'legend,tag,...'
+            per pathway. Pathways may differ in length; empty trailing cells are dropped.
+        """
+        energies, tag_ids, offsets = array('d'), array('i'), array('q', [0])
+        tag_index, legend, color = {}, [], []
+        with open(file_name, newline='') as file:
+            rows = (row for row in csv.reader(file) if any(cell.strip() for cell in row))
+            for n_row, row in enumerate(rows, 1):
+                while row and not row[-1].strip():
+                    row.pop()
+                if n_row % 2:
+                    color.append(row[0].strip())
+                    energies.extend(float(i) for i in row[1:])
+                    n_energy = len(row) - 1
+                else:
+                    if len(row) - 1 != n_energy:
+                        raise ValueError(f"Energy list and tag list must be of the same length (row {n_row}).")
+                    legend.append(row[0].strip())
+                    tag_ids.extend(tag_index.setdefault(i.strip(), len(tag_index)) for i in row[1:])
+                    offsets.append(len(energies))
+        if len(legend) != len(color):
+            raise ValueError(f"The energy row of pathway {len(color)} has no tag row.")
+        return cls(np.frombuffer(energies, dtype=float), np.frombuffer(tag_ids, dtype=np.int32),
+                   list(tag_index), np.frombuffer(offsets, dtype=np.int64), legend, color)
+
+    @classmethod
+    def from_lists(cls, energy_lists, tag_lists, legend, color):
+        tag_index = {}
+        tag_ids = [tag_index.setdefault(tag, len(tag_index)) for tags in tag_lists for tag in tags]
+        n_point = [len(i) for i in energy_lists]
+        if n_point != [len(i) for i in tag_lists]:
+            raise ValueError("Energy list and tag list must be of the same length.")
+        return cls(np.array([i for energies in energy_lists for i in energies], dtype=float),
+                   np.array(tag_ids, dtype=np.int32), list(tag_index),
+                   np.concatenate(([0], np.cumsum(n_point))).astype(np.int64), list(legend), list(color))
+
+    @property
+    def n_point(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('pathway index out of range')
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return EnergyTagPair.view(self.energies[start:end], self.tag_ids[start:end], self.tag_names)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+## PED straight from the OUTCARs of the calculations
+def parse_terms(spec):
+    """ Calculations whose energies are summed into one level: 'slab + 2*H2 - H2O' (spaces around
+        the operators), a list of directories, or {directory: coefficient}. Returns [(coefficient, directory)].
+    """
+    if isinstance(spec, dict):
+        return [(float(v), str(k)) for k, v in spec.items()]
+    if isinstance(spec, (list, tuple)):
+        return [term for i in spec for term in parse_terms(i)]
+    terms = []
+    for sign, term in zip(['+'] + re.findall(r'\s+([+-])\s+', spec), re.split(r'\s+[+-]\s+', spec.strip())):
+        coefficient, directory = term.split('*', 1) if re.match(r'^[\d.]+\*', term) else (1, term)
+        terms.append(((-1 if sign == '-' else 1) * float(coefficient), directory.strip()))
+    return terms
+
+def read_pathway_map(file_name):
+    """ The pathway steps and their calculation directories, relative to the map file.
+
+        yaml/json: {reference: ..., corrections: {directory: {zpe: .., ts: ..}},
+                    pathways: [{legend: .., color: .., reference: .., steps: [{tag: .., calc: .., zpe: .., ts: ..}]}]}
+        csv with the header legend,color,tag,calc[,zpe,ts]: one row per step, pathways in order of appearance.
+    """
+    if file_name.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(file_name) as file:
+            mapping = yaml.safe_load(file)
+    elif file_name.endswith('.json'):
+        with open(file_name) as file:
+            mapping = json.load(file)
+    else:
+        pathways = {}
+        with open(file_name, newline='') as file:
+            for row in csv.DictReader(file, skipinitialspace=True):
+                row = {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+                if 'calc' not in row:
+                    continue
+                pathway = pathways.setdefault(row['legend'], {'legend': row['legend'], 'color': row.get('color', 'k'), 'steps': []})
+                pathway['steps'].append({k: row[k] for k in ('tag', 'calc', 'zpe', 'ts') if k in row})
+        mapping = {'pathways': list(pathways.values())}
+    mapping['root'] = os.path.dirname(os.path.abspath(file_name))
+    return mapping
+
+def harvest_energies(directories, cache_file=None, jobs=None):
+    """ {directory: final energy} of the OUTCAR in every directory (or the given OUTCAR file), read
+        from the end of the files in parallel threads. Energies in cache_file are reused as long as
+        size and mtime of the OUTCAR are unchanged.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        from vasp_plot_conv import read_final_energy
+    except ImportError:
+        raise ImportError("vasp_plot_conv.py of the repository root must be on PYTHONPATH to read OUTCARs.")
+    outcars = {i: i if os.path.isfile(i) else os.path.join(i, 'OUTCAR') for i in directories}
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file) as file:
+            cache = json.load(file)
+    energies, identity, missing = {}, {}, []
+    for directory, outcar in outcars.items():
+        try:
+            stat = os.stat(outcar)
+        except OSError:
+            raise FileNotFoundError(f'No OUTCAR in {directory}')
+        key = os.path.abspath(outcar)
+        identity[key] = [stat.st_size, stat.st_mtime_ns]
+        if cache.get(key, {}).get('identity') == identity[key]:
+            energies[directory] = cache[key]['energy']
+        else:
+            missing.append(directory)
+
+    print (f'Reading {len(missing)} of {len(outcars)} OUTCARs ({len(outcars)-len(missing)} cached)...')
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        energies.update(zip(missing, pool.map(read_final_energy, [outcars[i] for i in missing])))
+    unfinished = [i for i in missing if np.isnan(energies[i])]
+    if unfinished:
+        raise ValueError('No complete ionic step with energy(sigma->0) in the OUTCAR of ' + ', '.join(unfinished))
+
+    if cache_file and missing:
+        cache.update({os.path.abspath(outcars[i]): {'identity': identity[os.path.abspath(outcars[i])],
+                                                    'energy': energies[i]} for i in missing})
+        tmp_name = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_name, 'w') as file:
+                json.dump(cache, file, indent=1)
+            os.replace(tmp_name, cache_file)
+        except OSError:
+            pass
+    return energies
+
+def build_pathways(mapping, cache_file='ped_energies.json', jobs=None):
+    """ PathwayTable of free energies G = sum(c * (E + zpe - ts)) + step zpe - step ts from a pathway
+        map (file name or dict, see read_pathway_map). reference: None (absolute energies), 'first'
+        (the first step of every pathway is 0), a number, or calculations like a step; a pathway
+        may override the global one. Corrections of the directories apply wherever they appear.
+    """
+    if isinstance(mapping, str):
+        if cache_file and not os.path.isabs(cache_file):
+            cache_file = os.path.join(os.path.dirname(os.path.abspath(mapping)), cache_file)
+        mapping = read_pathway_map(mapping)
+    root = mapping.get('root', '.')
+    path = lambda directory: os.path.normpath(os.path.join(root, directory))
+    corrections = {path(k): v for k, v in (mapping.get('corrections') or {}).items()}
+
+    def level_terms(spec):
+        #the calculations of a step, [(coefficient, directory)]
+        if isinstance(spec, (int, float)):
+            raise ValueError(f'calc {spec!r} is a number, not calculation directories; quote directory names in the pathway map')
+        return [(c, path(d)) for c, d in parse_terms(spec)]
+
+    def reference_terms(spec):
+        if spec is None or spec == 'first':
+            return spec
+        try:
+            return float(spec)
+        except (TypeError, ValueError):
+            return level_terms(spec)
+
+    pathways = []
+    for pathway in mapping['pathways']:
+        steps = [(str(step.get('tag', '')), level_terms(step['calc']), float(step.get('zpe', 0)) - float(step.get('ts', 0)))
+                 for step in pathway['steps']]
+        pathways.append((str(pathway.get('legend', f'path{len(pathways)+1}')), str(pathway.get('color', 'k')),
+                         steps, reference_terms(pathway.get('reference', mapping.get('reference')))))
+    directories = {d for pathway in pathways for step in pathway[2] for c, d in step[1]}
+    directories |= {d for pathway in pathways if isinstance(pathway[3], list) for c, d in pathway[3]}
+    energies = harvest_energies(sorted(directories), cache_file, jobs)
+
+    def free_energy(terms):
+        return sum(c * (energies[d] + float(corrections.get(d, {}).get('zpe', 0)) - float(corrections.get(d, {}).get('ts', 0)))
+                   for c, d in terms)
+
+    energy_lists, tag_lists = [], []
+    for legend, color, steps, reference in pathways:
+        levels = np.array([free_energy(terms) + correction for tag, terms, correction in steps])
+        if reference == 'first':
+            levels -= levels[0]
+        elif isinstance(reference, float):
+            levels -= reference
+        elif reference is not None:
+            levels -= free_energy(reference)
+        energy_lists.append(levels)
+        tag_lists.append([tag for tag, terms, correction in steps])
+    return PathwayTable.from_lists(energy_lists, tag_lists, [i[0] for i in pathways], [i[1] for i in pathways])
+
 class PEDGenerator(object):
     def __init__(self, file_name):
         print ('Loading data...')
@@ -49,9 +296,11 @@ class PEDGenerator(object):
         self.axis_name = {'x_axis':'Reaction coordinate',
                           'y_axis': 'Free Energy (eV)'}
         self.connect_type = 'cubic'
+        self.nbins = nbins
+        self.adaptive = False
         
-        # Extract data from file
-        self.data = self.load_data(file_name)
+        # Extract data from file, or take the pathways as they are
+        self.data = file_name if isinstance(file_name, PathwayTable) else self.load_data(file_name)
         self.legend, self.color, self.energy_tag_list = self.parse_data()
 
         self.book = None
@@ -59,7 +308,12 @@ class PEDGenerator(object):
         self.gl_s = None
 
     def load_data(self, file_name):
-        return np.loadtxt(file_name, delimiter=',', dtype=str)
+        return PathwayTable.read_csv(file_name)
+
+    @classmethod
+    def from_outcars(cls, mapping, cache_file='ped_energies.json', jobs=None):
+        """ PEDGenerator of the final energies of the calculations in a pathway map, see build_pathways. """
+        return cls(build_pathways(mapping, cache_file, jobs))
 
     def set_x_axis_name(self, name_list):
         self.axis_name['x_axis'] = name_list[0]
@@ -69,23 +323,29 @@ class PEDGenerator(object):
         self.connect_type = connect_type
     
     def parse_data(self):
-        legend = []
-        color = []
-        energy_tag_list = []
-
-        for i in enumerate(self.data):
-            if i[0] % 2 == 0:
-                if i[1][0] in self.color_dict:
-                    color.append(self.color_dict[i[1][0]])
-                else:
-                    color.append(i[1][0])
-                energy_list = i[1][1:].astype(float)
-            else:
-                legend.append(i[1][0])
-                tag_list = i[1][1:]
-                energy_tag_list.append(EnergyTagPair(energy_list, tag_list))
-        return legend, color, energy_tag_list
+        color = [self.color_dict.get(i, i) for i in self.data.color]
+        return list(self.data.legend), color, self.data
     
+    @staticmethod
+    def hermite_curves(x0, x1, y0, y1, counts):
+        """ Sample the cubic with f'(x0) = f'(x1) = 0 between (x0, y0) and (x1, y1)
+            of many segments at once, in closed form:
+            f = y0 + (y1 - y0) * (3t^2 - 2t^3), t = (x - x0) / (x1 - x0).
+
+        Args:
+            x0, x1, y0, y1 (np.ndarray): ends of every segment.
+            counts (np.ndarray): points per segment, including both ends; 2 gives the straight line.
+
+        Returns:
+            np.ndarray: (sum(counts), 2) points, segment after segment.
+        """
+        counts = np.asarray(counts)
+        seg = np.repeat(np.arange(len(counts)), counts)
+        t = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)) / (counts[seg] - 1)
+        h = t * t * (3 - 2 * t)
+        # (1-t)*a + t*b keeps both ends exact
+        return np.column_stack(((1 - t) * x0[seg] + t * x1[seg], (1 - h) * y0[seg] + h * y1[seg]))
+
     @staticmethod
     def cubic_fit(rcoord, energy, nbins=nbins):
         """ Build a cubic polynomial that satisfies
@@ -102,20 +362,66 @@ class PEDGenerator(object):
         Returns:
             xfit, yfit: the points of fitted curve.
         """
-        
-        x0, y0 = rcoord[0], energy[0]
-        x1, y1 = rcoord[1], energy[1]
-        A = np.array([
-                [x0**3,   x0**2, x0, 1],
-                [x1**3,   x1**2, x1, 1],
-                [3*x0**2,  2*x0,  1, 0],
-                [3*x1**2,  2*x1,  1, 0]])
-        b = np.array([y0, y1, 0, 0])
-        coeff = np.linalg.solve(A, b)
-        xfit = np.linspace(x0, x1, nbins)
-        yfit = np.polyval(coeff, xfit)
-        return xfit, yfit
-    
+        curve = PEDGenerator.hermite_curves(np.array(rcoord[:1]), np.array(rcoord[1:2]),
+                                            np.array(energy[:1]), np.array(energy[1:2]), [nbins])
+        return curve[:, 0], curve[:, 1]
+
+    def set_sampling(self, nbins=nbins, adaptive=False):
+        """ Points per cubic segment. adaptive: the segment with the largest energy change of
+            the whole diagram gets nbins points, the others proportionally fewer (at least 16).
+        """
+        self.nbins = nbins
+        self.adaptive = adaptive
+
+    def gen_all_line_scatter_data(self, energy_tag_list=None):
+        """ line_data, scatter_data of every pathway; the curves of all segments of all
+            pathways are evaluated in one batch.
+        """
+        energy_tag_list = self.energy_tag_list if energy_tag_list is None else energy_tag_list
+        if isinstance(energy_tag_list, PathwayTable):
+            energy, n_point = energy_tag_list.energies, energy_tag_list.n_point
+            is_ts = np.array(['ts' in i.lower() for i in energy_tag_list.tag_names], dtype=bool)[energy_tag_list.tag_ids]
+        else:
+            energy_tag_list = [i if hasattr(i, 'tag_ids') else EnergyTagPair([j.energy for j in i], [j.tag for j in i])
+                               for i in energy_tag_list]
+            n_point = np.array([len(i) for i in energy_tag_list])
+            energy = np.concatenate([i.energies for i in energy_tag_list])
+            is_ts = np.concatenate([np.array(['ts' in j.lower() for j in i.tag_names], dtype=bool)[i.tag_ids]
+                                    for i in energy_tag_list])
+        index = np.concatenate([np.arange(i) for i in n_point])
+        splits = np.cumsum(n_point)[:-1]
+
+        if self.connect_type == 'line':
+            step = self.spacing_between_bar + bar_width
+            scatter_data = np.column_stack((index*step + 1/2*bar_width, energy))
+            line_data = np.column_stack((np.repeat(index*step, 2) + np.tile([0, bar_width], len(index)),
+                                         np.repeat(energy, 2)))
+            return list(zip(np.split(line_data, 2*splits), np.split(scatter_data, splits)))
+
+        elif self.connect_type == 'cubic':
+            scatter_data = np.column_stack((index*self.spacing_between_bar, energy))
+            # segment k joins point k and k+1; it is cubic next to a TS that is not an end point
+            last = np.cumsum(n_point) - 1
+            if is_ts[last].any():
+                raise ValueError("The last point can't be a transition state.")
+            interior_ts = is_ts & (index > 0)
+            seg_start = np.setdiff1d(np.arange(len(energy)), last)
+            cubic = interior_ts[seg_start] | interior_ts[seg_start + 1]
+
+            dy = np.abs(energy[seg_start + 1] - energy[seg_start])
+            if self.adaptive and dy[cubic].size and dy[cubic].max() > 0:
+                n_cubic = np.maximum(16, np.ceil(self.nbins * dy / dy[cubic].max())).astype(int)
+            else:
+                n_cubic = self.nbins
+            counts = np.where(cubic, n_cubic, 2)
+            line_data = self.hermite_curves(scatter_data[seg_start, 0], scatter_data[seg_start + 1, 0],
+                                            scatter_data[seg_start, 1], scatter_data[seg_start + 1, 1], counts)
+            # segments per pathway: n_point - 1
+            line_splits = np.concatenate(([0], np.cumsum(counts)))[np.cumsum(n_point - 1)[:-1]]
+            return list(zip(np.split(line_data, line_splits), np.split(scatter_data, splits)))
+        else:
+            raise ValueError("connet_type must be 'cubic' or 'line'.")
+
     def gen_line_scatter_data(self, energy_tag):
         """_summary_
 
@@ -125,60 +431,21 @@ class PEDGenerator(object):
         Returns:
             line: data for line and scatter plot.
         """
-        energy_list = [i.energy for i in energy_tag]
-        tag_list = [i.tag for i in energy_tag]
-        scatter_data = np.zeros((len(energy_list), 2))
-            
-        if self.connect_type == 'line':
-            for i in enumerate(energy_list):
-                scatter_data[i[0]] = [i[0]*(self.spacing_between_bar+bar_width)+
-                                    1/2*bar_width, i[1]]
-            
-            line_data = np.zeros((len(energy_list)*2, 2))
-            for i in enumerate(energy_list):
-                line_data[i[0]*2] = [i[0]*(self.spacing_between_bar+bar_width), i[1]]
-                line_data[i[0]*2+1] = [(i[0])*(self.spacing_between_bar+bar_width)+
-                                       bar_width, i[1]]
-        
-        elif self.connect_type == 'cubic':
-            for i in enumerate(energy_list):
-                scatter_data[i[0]] = [i[0]*(self.spacing_between_bar), i[1]]
-            
-            _connect_list = ['line'] * (len(tag_list)-1)
-            for i in range(1, len(tag_list)-1):
-                if 'ts' in tag_list[i].lower():
-                    _connect_list[i-1] = 'cubic'
-                    _connect_list[i] = 'cubic'
-            if 'ts' in tag_list[-1].lower():
-                raise ValueError("The last point can't be a transition state.")
-            
-            line_data = []
-            for i in enumerate(_connect_list):
-                _rcood = [scatter_data[i[0],0], scatter_data[i[0]+1,0]]
-                _energy = [scatter_data[i[0],1], scatter_data[i[0]+1,1]]
-                if i[1] == 'cubic':
-                    xfit, yfit = self.cubic_fit(_rcood, _energy)
-                    line_data.extend([i for i in zip(xfit, yfit)])
-                elif i[1] == 'line':
-                    line_data.extend([i for i in zip(_rcood, _energy)])
-            line_data = np.array(line_data).reshape(-1,2)
-        else:
-            raise ValueError("connet_type must be 'cubic' or 'line'.")
-        
-        return line_data, scatter_data
+        return self.gen_all_line_scatter_data([energy_tag])[0]
 
-    def save_data(self, file_name='PED.data'):
+    def save_data(self, file_name='PED.data', line_scatter_data=None):
         print (f'Saving {file_name}...')
+        line_scatter_data = self.gen_all_line_scatter_data() if line_scatter_data is None else line_scatter_data
         data_file = open(file_name, 'w')
-        for i in zip(self.legend, self.color, self.energy_tag_list):
+        for i in zip(self.legend, self.color, self.energy_tag_list, line_scatter_data):
             data_file.write(f'#{i[0]} {i[1]}\n')            
             axis_name = np.array(list([self.axis_name['x_axis'], self.axis_name['y_axis']]))
             axis_name = axis_name.reshape(1,2)
-            tag_name = np.array([i.tag for i in i[2]])
+            tag_name = np.array(i[2].tags)
             tag_name = np.hstack((['Tag name'], tag_name))
             tag_name = tag_name.reshape(-1,1)
 
-            line_data, scatter_data = self.gen_line_scatter_data(i[2])
+            line_data, scatter_data = i[3]
             line_data = np.vstack((axis_name, line_data))
             scatter_data = np.vstack((axis_name, scatter_data))
             scatter_data = np.hstack((scatter_data, tag_name))
@@ -193,34 +460,124 @@ class PEDGenerator(object):
             line_scatter_data = np.hstack((filled_line_data, filled_scatter_data))
             np.savetxt(data_file, line_scatter_data, delimiter=',', fmt='%s')
             data_file.write(f'{"#"*50}\n')
-        data_file.close
+        data_file.close()
+
+    @staticmethod
+    def render_figure(line_scatter_data, labels, color, axis_name, file_name='PED.png', plot_kwargs={},
+                      scatter_kwargs={}, batch=True, dpi=600, legend=True, close=False):
+        """ Draw and save one diagram from the output of gen_all_line_scatter_data.
 
-    def plot_with_mpl(self, plot_kwargs={}, scatter_kwargs={}, file_name='PED.png'):
+        Args:
+            batch (bool, optional): draw all lines as one LineCollection and all levels as one
+                scatter; plot_kwargs then go to the LineCollection. Pathways whose color is a
+                plt.plot format string (e.g. 'r--') are drawn one by one. Defaults to True.
+            legend (bool, optional): draw the legend, which dominates the drawing time for
+                hundreds of pathways. Defaults to True.
+            close (bool, optional): close the figure after saving. Defaults to False.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import is_color_like
         print (f'Saving {file_name}...')
-        plt.figure(figsize=(10, 6))
+        fig = plt.figure(figsize=(10, 6))
         plot_kwargs_default = {'linewidth': 2}
         scatter_kwargs_default = {'s': 600, 'marker': '_', 'c': 'k'}
         plot_kwargs = {**plot_kwargs_default, **plot_kwargs}
         scatter_kwargs = {**scatter_kwargs_default, **scatter_kwargs}
-        
-        for i in zip(self.legend, self.color, self.energy_tag_list):
-            line_data, scatter_data = self.gen_line_scatter_data(i[2])            
-            plt.plot(line_data[:, 0], line_data[:, 1], i[1], label=i[0], **plot_kwargs)          
+
+        if batch and all(is_color_like(i) for i in color):
+            from matplotlib.collections import LineCollection
+            from matplotlib.lines import Line2D
+            line_kwargs = dict(plot_kwargs)
+            colors = [line_kwargs.pop('color')]*len(color) if 'color' in line_kwargs else color
+            # cap and join style of plt.plot lines, which differ for solid and dashed lines
+            linestyle = line_kwargs.get('linestyle', line_kwargs.get('ls', '-'))
+            style = 'solid' if linestyle in ('-', 'solid') else 'dash'
+            lines = LineCollection([i[0] for i in line_scatter_data], colors=colors,
+                                   capstyle=plt.rcParams[f'lines.{style}_capstyle'],
+                                   joinstyle=plt.rcParams[f'lines.{style}_joinstyle'], **line_kwargs)
+            ax = plt.gca()
+            ax.add_collection(lines)
+            ax.autoscale_view()
+            scatter_data = np.concatenate([i[1] for i in line_scatter_data])
             plt.scatter(scatter_data[:, 0], scatter_data[:, 1], **scatter_kwargs)
-            
+            if legend:
+                plt.legend(handles=[Line2D([], [], label=i[0], **{**line_kwargs, 'color': i[1]})
+                                    for i in zip(labels, colors)])
+        else:
+            for i in zip(labels, color, line_scatter_data):
+                line_data, scatter_data = i[2]
+                plt.plot(line_data[:, 0], line_data[:, 1], i[1], label=i[0], **plot_kwargs)
+                plt.scatter(scatter_data[:, 0], scatter_data[:, 1], **scatter_kwargs)
+            if legend:
+                plt.legend()
+
         plt.title('Potential Energy Diagram')
-        plt.xlabel(self.axis_name['x_axis'])
-        plt.ylabel(self.axis_name['y_axis'])
-        plt.legend()
+        plt.xlabel(axis_name['x_axis'])
+        plt.ylabel(axis_name['y_axis'])
+
+        # plt.savefig would draw the figure a second time afterwards
+        fig.savefig(f'{file_name}', dpi=dpi)
+        if close:
+            plt.close(fig)
+        return file_name
 
-        plt.savefig(f'{file_name}', dpi=600)
+    def plot_with_mpl(self, plot_kwargs={}, scatter_kwargs={}, file_name='PED.png', batch=True, dpi=600, legend=True,
+                      line_scatter_data=None):
+        line_scatter_data = self.gen_all_line_scatter_data() if line_scatter_data is None else line_scatter_data
+        return self.render_figure(line_scatter_data, self.legend, self.color, self.axis_name,
+                                  file_name, plot_kwargs, scatter_kwargs, batch, dpi, legend)
+
+    @staticmethod
+    def _use_agg():
+        import matplotlib
+        matplotlib.use('Agg', force=True)
+
+    def plot_subsets(self, groups='color', file_name='PED_{}.png', jobs=None, plot_kwargs={},
+                     scatter_kwargs={}, batch=True, dpi=600, legend=True):
+        """ One figure per group of pathways, rendered in parallel worker processes with the Agg backend.
+
+        Args:
+            groups (dict or str, optional): {name: [legend or index of a pathway, ...]}, or 'color' /
+                'legend' for one figure per color / per pathway. Defaults to 'color'.
+            file_name (str, optional): formatted with the group name. Defaults to 'PED_{}.png'.
+            jobs (int, optional): worker processes, 1 renders here. Defaults to the number of CPUs.
+
+        Returns:
+            list: the saved file names.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if groups in ('color', 'legend'):
+            keys = self.color if groups == 'color' else self.legend
+            groups = {}
+            for index, key in enumerate(keys):
+                groups.setdefault(key.lstrip('#'), []).append(index)
+        legend_index = {legend: index for index, legend in enumerate(self.legend)}
+        line_scatter_data = self.gen_all_line_scatter_data()
+
+        tasks = []
+        for name, members in groups.items():
+            index = [legend_index[i] if isinstance(i, str) else i for i in members]
+            tasks.append(([line_scatter_data[i] for i in index], [self.legend[i] for i in index],
+                          [self.color[i] for i in index], self.axis_name,
+                          file_name.format(str(name).replace(os.sep, '_')),
+                          plot_kwargs, scatter_kwargs, batch, dpi, legend, True))
+        if jobs == 1 or len(tasks) < 2:
+            return [self.render_figure(*i) for i in tasks]
+        with ProcessPoolExecutor(max_workers=jobs, initializer=self._use_agg) as pool:
+            return list(pool.map(self.render_figure, *zip(*tasks)))
   
     @staticmethod
     def origin_shutdown_exception_hook(exctype, value, traceback):
+        import originpro as op
         op.exit()
         sys.__excepthook__(exctype, value, traceback)
               
     def plot_with_origin(self, file_name='PED.opju'):
+        try:
+            import originpro as op
+        except ImportError:
+            # Origin only runs on Windows; PED.data and matplotlib output work without it
+            raise ImportError("originpro is required for plot_with_origin, use plot_with_mpl instead.")
         print (f'Saving {file_name}...')
         path = os.getcwd()
         if os.path.exists(rf'{path}\{file_name}'):
@@ -233,8 +590,8 @@ class PEDGenerator(object):
         self.book = op.new_book(type='w', lname='PED data')
         sheet_list = []
         _n = 0
-        for i in zip(self.legend, self.energy_tag_list):
-            line_data, scatter_data = self.gen_line_scatter_data(i[1])
+        for i in zip(self.legend, self.energy_tag_list, self.gen_all_line_scatter_data()):
+            line_data, scatter_data = i[2]
             if _n == 0:
                 wks = self.book[0]
                 wks.name = f'{i[0]}'
@@ -244,7 +601,7 @@ class PEDGenerator(object):
             wks.from_list(1, line_data[:, 1], lname=self.axis_name['y_axis'], axis='Y')
             wks.from_list(2, scatter_data[:, 0], lname=self.axis_name['x_axis'], axis='X')
             wks.from_list(3, scatter_data[:, 1], lname=self.axis_name['y_axis'], axis='Y')
-            wks.from_list(4, [i.tag for i in i[1]], lname='Tag name', axis='Y')
+            wks.from_list(4, i[1].tags, lname='Tag name', axis='Y')
             sheet_list.append(wks)
             _n += 1
         
@@ -273,9 +630,48 @@ class PEDGenerator(object):
         op.exit()
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Draw the potential energy diagram of the pathways in a csv, '
+                                                 'or of the calculations in a pathway map (see PEDGenerator.from_outcars).')
+    parser.add_argument('-i', '--input', type=str, action='store', default='test.csv',
+                        help='The csv of alternating color,energy,... and legend,tag,... rows. [Optional] [default=test.csv]')
+    parser.add_argument('--map', type=str, action='store', default=None,
+                        help='Read the energies from the OUTCARs of a pathway map (.yaml/.json/.csv) instead of --input. [Optional]')
+    parser.add_argument('-o', '--output', type=str, action='store', default='PED.data',
+                        help='The line & scatter data file. [Optional] [default=PED.data]')
+    parser.add_argument('-p', '--plot', type=str, action='store', choices={'origin', 'mpl', 'none'}, default='origin',
+                        help='Plot with originpro (PED.opju) or matplotlib (PED.png). [Optional] [default=origin]')
+    parser.add_argument('--profile', type=str, action='store', nargs='?', const='DrawPED_profile.json', default=None,
+                        help='Record wall/CPU time, bytes read/written and peak memory of every stage into this JSON report. '
+                             '[Optional] [default=DrawPED_profile.json]')
+    parser.add_argument('--cprofile', type=str, action='store', default=None,
+                        help='Also run this stage of --profile under cProfile, dumped to profile_STAGE.prof. [Optional]')
+    args = parser.parse_args()
+    if args.profile:
+        try:
+            from stage_profile import StageProfile
+        except ImportError:
+            raise ImportError("stage_profile.py of the repository root must be on PYTHONPATH for --profile.")
+        profile = StageProfile(args.profile, args.cprofile)
+    else:
+        profile = lambda name: contextlib.nullcontext()
+
     print ('Initializing...')
-    ped_generator = PEDGenerator('test.csv')
-    ped_generator.save_data('PED.data')
-    # ped_generator.plot_with_mpl(plot_kwargs={'linestyle': ':'}, scatter_kwargs={'marker': '_'}, file_name='PED.png')
-    ped_generator.plot_with_origin('PED.opju')
+    with profile('harvest' if args.map else 'load'):
+        ped_generator = PEDGenerator.from_outcars(args.map) if args.map else PEDGenerator(args.input)
+    #the curves are evaluated once, for PED.data and the plot
+    with profile('curves'):
+        line_scatter_data = ped_generator.gen_all_line_scatter_data()
+    with profile('save_data'):
+        ped_generator.save_data(args.output, line_scatter_data)
+    if args.plot == 'mpl':
+        with profile('render'):
+            ped_generator.plot_with_mpl(file_name='PED.png', line_scatter_data=line_scatter_data)
+        # ped_generator.plot_with_mpl(plot_kwargs={'linestyle': ':'}, scatter_kwargs={'marker': '_'}, file_name='PED.png')
+        # ped_generator.plot_subsets({'Pt': ['Pt-1', 'Pt-2'], 'Pd': ['Pd-1']}, file_name='PED_{}.png')
+    elif args.plot == 'origin':
+        with profile('origin'):
+            ped_generator.plot_with_origin('PED.opju')
     print ('DrawPED Finished!')
+    if args.profile:
+        profile.write()
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Time the hot paths of the scripts on synthetic inputs.
+
+Every stage runs in a fresh process: the inputs are prepared first, then the
+peak RSS is reset (Linux /proc/self/clear_refs) and the stage is timed, so the
+reported peak memory belongs to the stage alone. Results go to a JSON file;
+--compare prints the ratio to an earlier result, e.g. of another commit.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import contextlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'DrawPED_Origin'))
+
+
+## synthetic inputs
+def make_poscar(file_name, n_atoms, selective=True, seed=0):
+    rng = np.random.default_rng(seed)
+    n_ads = min(4, n_atoms // 2)
+    with open(file_name, 'w') as file:
+        file.write('synthetic slab\n1.0\n')
+        file.write(f'{2.8*n_atoms**(1/3):.6f} 0.0 0.0\n0.0 {2.8*n_atoms**(1/3):.6f} 0.0\n0.0 0.0 30.0\n')
+        file.write(f'Pt O\n{n_atoms-n_ads} {n_ads}\n')
+        file.write('Selective dynamics\nDirect\n' if selective else 'Direct\n')
+        for i in range(n_atoms):
+            flags = (' F F F' if i < n_atoms//2 else ' T T T') if selective else ''
+            file.write('  {:.8f}  {:.8f}  {:.8f}'.format(*rng.random(3)) + flags + '\n')
+
+
+def make_outcar(file_name, n_atoms, n_steps, n_electronic=10, seed=0):
+    #the lines the parser looks at, embedded in the usual electronic-step noise
+    rng = np.random.default_rng(seed)
+    electronic = ''.join(
+        f'----------------------------------------- Iteration {{step:6d}}({j+1:4d})  ---------------------------------------\n'
+        '\n    POTLOK:  cpu time      0.0100: real time      0.0100\n'
+        '    SETDIJ:  cpu time      0.0010: real time      0.0010\n'
+        '     EDDAV:  cpu time      0.1000: real time      0.1000\n'
+        '       DOS:  cpu time      0.0010: real time      0.0010\n'
+        '    CHARGE:  cpu time      0.0100: real time      0.0100\n'
+        '    MIXING:  cpu time      0.0010: real time      0.0010\n'
+        '    --------------------------------------------\n'
+        '      LOOP:  cpu time      0.1300: real time      0.1300\n\n'
+        ' eigenvalue-minimisations  :   384\n'
+        ' total energy-change (2. order) :-0.1234567E-02  (-0.1234567E-03)\n'
+        f' number of electron     {8*n_atoms:.7f} magnetization       {{mag:.7f}}\n'
+        ' augmentation part        3.1234567 magnetization       0.0000001\n\n'
+        ' Free energy of the ion-electron system (eV)\n'
+        '  ---------------------------------------------------\n'
+        '  alpha Z        PSCENC =         1.23456789\n'
+        '  Ewald energy   TEWEN  =     12345.67890123\n'
+        '  -Hartree energ DENC   =    -12345.67890123\n'
+        '  -exchange      EXHF   =         0.00000000\n'
+        '  -V(xc)+E(xc)   XCENC  =       123.45678901\n'
+        '  PAW double counting   =      1234.56789012     -1234.56789012\n'
+        '  entropy T*S    EENTRO =        -0.00123456\n'
+        '  eigenvalues    EBANDS =      -123.45678901\n'
+        '  atomic energy  EATOM  =     12345.67890123\n'
+        '  Solvation  Ediel_sol  =         0.00000000\n'
+        '  ---------------------------------------------------\n'
+        '  free energy    TOTEN  =      -123.45678901 eV\n\n'
+        '  energy without entropy =     -123.45678901  energy(sigma->0) =     -123.45678901\n\n\n'
+        '--------------------------------------------------------------------------------------------------------\n\n'
+        for j in range(n_electronic))
+    with open(file_name, 'w') as file:
+        file.write(' vasp.6.3.0 18Jan22 (build Feb 08 2022 16:17:17) complex\n executed on  LinuxIFC date 2024.01.01  00:00:00\n')
+        file.write('   EDIFFG = -.2E-01   stopping-criterion for IOM\n')
+        for step in range(n_steps):
+            file.write(electronic.format(step=step+1, mag=1.5+1e-3*step))
+            file.write('  FORCE on cell =-STRESS in cart. coord.  units (eV):\n'
+                       '  Direction    XX          YY          ZZ          XY          YZ          ZX\n'
+                       '  --------------------------------------------------------------------------------------\n'
+                       '  Total        1.00000     2.00000     3.00000     0.10000     0.20000     0.30000\n'
+                       '  in kB       {:.5f}     {:.5f}     {:.5f}     0.10000     0.20000     0.30000\n'
+                       '  external pressure =        1.00 kB  Pullay stress =        0.00 kB\n\n'.format(*rng.random(3)))
+            block = np.hstack((rng.random((n_atoms, 3))*10, (rng.random((n_atoms, 3))-0.5)/(step+1)))
+            file.write(' POSITION                                       TOTAL-FORCE (eV/Angst)\n')
+            file.write(' ' + '-'*83 + '\n')
+            file.write(('     %8.5f     %8.5f     %8.5f       %12.6f   %12.6f   %12.6f\n'*n_atoms) % tuple(block.ravel()))
+            file.write(' ' + '-'*83 + '\n    total drift:                               -0.000001     -0.000002      0.000003\n\n\n')
+            file.write('--------------------------------------------------------------------------------------------------------\n\n\n\n')
+            file.write('  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\n  ---------------------------------------------------\n'
+                       f'  free  energy   TOTEN  =      {-123-1e-3*step:.8f} eV\n\n'
+                       f'  energy  without entropy=     {-123-1e-3*step:.8f}  energy(sigma->0) =     {-123-1e-3*step:.8f}\n\n\n\n'
+                       '--------------------------------------------------------------------------------------------------------\n\n\n'
+                       f'     LOOP+:  cpu time      {1.3+step*1e-3:.4f}: real time      {1.3+step*1e-3:.4f}\n')
+        file.write('\n\n General timing and accounting informations for this job:\n')
+
+
+def make_vasprun(file_name, n_atoms, n_steps, n_electronic=10, seed=0):
+    #the same run as make_outcar written by VASP into vasprun.xml, self-consistent steps included
+    rng = np.random.default_rng(seed)
+    n_ads = min(4, n_atoms // 2)
+    length = 2.8*n_atoms**(1/3)
+    basis = f'    <v>{length:16.8f}{0:16.8f}{0:16.8f} </v>\n    <v>{0:16.8f}{length:16.8f}{0:16.8f} </v>\n    <v>{0:16.8f}{0:16.8f}{30:16.8f} </v>\n'
+    scstep = ''.join(
+        '  <scstep>\n   <time name="dav">    0.10    0.10</time>\n   <time name="total">    0.13    0.13</time>\n'
+        '   <energy>\n    <i name="alphaZ">      1.23456789 </i>\n    <i name="ewald">  12345.67890123 </i>\n'
+        '    <i name="hartreedc"> -12345.67890123 </i>\n    <i name="XCdc">    123.45678901 </i>\n'
+        '    <i name="pawpsdc">   1234.56789012 </i>\n    <i name="pawaedc">  -1234.56789012 </i>\n'
+        '    <i name="eentropy">     -0.00123456 </i>\n    <i name="bandstr">   -123.45678901 </i>\n'
+        '    <i name="atom">  12345.67890123 </i>\n    <i name="e_fr_energy">   -123.45678901 </i>\n'
+        '    <i name="e_wo_entrp">   -123.45678901 </i>\n    <i name="e_0_energy">   -123.45678901 </i>\n'
+        '   </energy>\n  </scstep>\n' for j in range(n_electronic))
+    with open(file_name, 'w') as file:
+        file.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n <generator>\n'
+                   '  <i name="program" type="string">vasp </i>\n  <i name="version" type="string">6.3.0  </i>\n </generator>\n'
+                   ' <incar>\n  <i name="EDIFFG">     -0.02000000</i>\n </incar>\n')
+        file.write(f' <atominfo>\n  <atoms>{n_atoms:8d} </atoms>\n  <types>       2 </types>\n'
+                   '  <array name="atoms" >\n   <dimension dim="1">ion</dimension>\n'
+                   '   <field type="string">element</field>\n   <field type="int">atomtype</field>\n   <set>\n')
+        file.write(''.join(f'    <rc><c>{"Pt" if i < n_atoms - n_ads else "O "}</c><c>   {1 if i < n_atoms - n_ads else 2}</c></rc>\n'
+                           for i in range(n_atoms)))
+        file.write('   </set>\n  </array>\n </atominfo>\n <structure name="initialpos" >\n  <crystal>\n'
+                   f'   <varray name="basis" >\n{basis}   </varray>\n  </crystal>\n  <varray name="positions" >\n')
+        file.write(''.join('   <v>{:16.8f}{:16.8f}{:16.8f} </v>\n'.format(*i) for i in rng.random((n_atoms, 3))))
+        file.write('  </varray>\n  <varray type="logical" name="selective" >\n')
+        file.write(''.join('   <v>' + ('  F  F  F' if i < n_atoms//2 else '  T  T  T') + ' </v>\n' for i in range(n_atoms)))
+        file.write('  </varray>\n </structure>\n')
+        for step in range(n_steps):
+            energy = -123 - 1e-3*step
+            file.write(f' <calculation>\n{scstep}  <structure>\n   <crystal>\n    <varray name="basis" >\n{basis}    </varray>\n'
+                       '   </crystal>\n   <varray name="positions" >\n')
+            file.write(('    <v>%16.8f%16.8f%16.8f </v>\n'*n_atoms) % tuple(rng.random(3*n_atoms)))
+            file.write('   </varray>\n  </structure>\n  <varray name="forces" >\n')
+            file.write(('   <v>%16.8f%16.8f%16.8f </v>\n'*n_atoms) % tuple((rng.random(3*n_atoms)-0.5)/(step+1)))
+            file.write('  </varray>\n  <varray name="stress" >\n')
+            file.write('   <v>{:16.8f}{:16.8f}{:16.8f} </v>\n   <v>{:16.8f}{:16.8f}{:16.8f} </v>\n   <v>{:16.8f}{:16.8f}{:16.8f} </v>\n'
+                       .format(*rng.random(9)))
+            file.write(f'  </varray>\n  <energy>\n   <i name="e_fr_energy">{energy:16.8f} </i>\n'
+                       f'   <i name="e_wo_entrp">{energy:16.8f} </i>\n   <i name="e_0_energy">{energy:16.8f} </i>\n  </energy>\n'
+                       f'  <time name="totalsc">{1.3+step*1e-3:8.2f}{1.3+step*1e-3:8.2f}</time>\n </calculation>\n')
+        file.write('</modeling>\n')
+
+
+def make_ped_csv(file_name, n_pathways, n_points=6, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(file_name, 'w') as file:
+        for i in range(n_pathways):
+            energy = np.round(np.cumsum(rng.normal(0, 0.5, n_points)) - 0.0, 3)
+            tags = ['S'] + [('TS' if j % 2 else 'IM') + str(j) for j in range(1, n_points-1)] + ['P']
+            file.write('k,' + ','.join(map(str, energy)) + '\n')
+            file.write(f'path{i+1},' + ','.join(tags) + '\n')
+
+
+def make_neb_endpoints(n_atoms):
+    from ase.build import fcc111, add_adsorbate
+    from ase.constraints import FixAtoms
+    #~n_atoms Pt(111) slab with an O hopping from fcc over a Pt atom to an hcp site, bottom two layers fixed
+    layers = 4
+    size = max(2, int(round((n_atoms / layers) ** 0.5)))
+    initial = fcc111('Pt', size=(size, size, layers), vacuum=8.0)
+    final = initial.copy()
+    add_adsorbate(initial, 'O', 1.2, 'fcc')
+    add_adsorbate(final, 'O', 1.2, 'hcp', offset=(1, 1))
+    for atoms in (initial, final):
+        atoms.set_constraint(FixAtoms(indices=[atom.index for atom in atoms if atom.tag > layers // 2]))
+    return initial, final
+
+
+## stages: setup(workdir, params) -> callable timed in the stage process
+def _vpc():
+    import vasp_plot_conv
+    return vasp_plot_conv
+
+
+def setup_poscar_parse(workdir, params):
+    vpc = _vpc()
+    return lambda: vpc.read_poscar(os.path.join(workdir, 'POSCAR'))
+
+
+def setup_outcar_read(workdir, params):
+    #raw chunked I/O, the floor for every parser
+    chunk_size = _vpc().CHUNK_SIZE
+    def run():
+        with open(os.path.join(workdir, 'OUTCAR'), 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                pass
+    return run
+
+
+def setup_outcar_extract(workdir, params):
+    vpc = _vpc()
+    return lambda: vpc.parse_outcar(os.path.join(workdir, 'OUTCAR'), cache=False)
+
+
+def setup_vasprun_extract(workdir, params):
+    #the same run from vasprun.xml, sets the parse rates of vpc.choose_source
+    vpc = _vpc()
+    return lambda: vpc.parse_vasprun(os.path.join(workdir, 'vasprun.xml'))
+
+
+def setup_outcar_cached(workdir, params):
+    #a repeated run on an unchanged OUTCAR, served by the sidecar cache
+    vpc = _vpc()
+    vpc.parse_outcar(os.path.join(workdir, 'OUTCAR'), cache=True)
+    return lambda: vpc.parse_outcar(os.path.join(workdir, 'OUTCAR'), cache=True)
+
+
+def _conv(workdir):
+    vpc = _vpc()
+    atominfo_list, selective_list, selective_list_array = vpc.read_poscar(os.path.join(workdir, 'POSCAR'))
+    outcar_data = vpc.parse_outcar(os.path.join(workdir, 'OUTCAR'), cache=False)
+    return vpc, outcar_data, atominfo_list, selective_list, selective_list_array
+
+
+def setup_force_reduction(workdir, params):
+    vpc, outcar_data, atominfo_list, selective_list, selective_list_array = _conv(workdir)
+    return lambda: vpc.check_conv(outcar_data, selective_list_array)
+
+
+def setup_log_write(workdir, params):
+    vpc, outcar_data, atominfo_list, selective_list, selective_list_array = _conv(workdir)
+    conv = vpc.check_conv(outcar_data, selective_list_array)
+    return lambda: vpc.write_log(conv, atominfo_list, selective_list, os.path.join(workdir, 'check_conv.log'))
+
+
+#the scripts import their backends lazily; setup imports them first so the stages time the work only
+#(the import cost is measured by startup.py)
+def setup_term_plot(workdir, params):
+    import plotille
+    vpc, outcar_data, atominfo_list, selective_list, selective_list_array = _conv(workdir)
+    conv = vpc.check_conv(outcar_data, selective_list_array)
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            vpc.show_conv(conv, atominfo_list, 'f', 'term')
+    return run
+
+
+def setup_mp_plot(workdir, params):
+    import matplotlib.pyplot
+    vpc, outcar_data, atominfo_list, selective_list, selective_list_array = _conv(workdir)
+    conv = vpc.check_conv(outcar_data, selective_list_array)
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            vpc.show_conv(conv, atominfo_list, 'f', 'mp')
+    return run
+
+
+def setup_neb_band(workdir, params):
+    #the moving images of an NEB, each a copy of the synthetic POSCAR/OUTCAR, parsed in parallel without cache
+    vpc = _vpc()
+    band = os.path.join(workdir, 'band')
+    for i in range(params['neb_images'] + 2):
+        os.makedirs(os.path.join(band, f'{i:02d}'), exist_ok=True)
+        if 0 < i <= params['neb_images']:
+            for name in ('POSCAR', 'OUTCAR'):
+                shutil.copy(os.path.join(workdir, name), os.path.join(band, f'{i:02d}', name))
+    return lambda: vpc.survey_band(band, cache=False)
+
+
+def setup_neb_idpp(workdir, params, engine='native'):
+    import neb_generate
+    import ase.neighborlist
+    neb_generate.get_neb_class()
+    initial, final = make_neb_endpoints(params['neb_atoms'])
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            neb_generate.idpp_interpolation(initial, final, params['neb_images'], engine)
+    return run
+
+
+def setup_neb_write(workdir, params):
+    import neb_generate
+    import ase.io
+    initial, final = make_neb_endpoints(params['neb_atoms'])
+    images = neb_generate.linear_interpolation(initial, final, params['neb_images'])
+    return lambda: neb_generate.write_images(images, 'line')
+
+
+def setup_neb_idpp_ase(workdir, params):
+    return setup_neb_idpp(workdir, params, 'ase')
+
+
+def setup_ped_load(workdir, params):
+    import DrawPED
+    file_name = os.path.join(workdir, 'ped.csv')
+    make_ped_csv(file_name, params['pathways'])
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return DrawPED.PEDGenerator(file_name)
+    return run
+
+
+def setup_ped_line_scatter(workdir, params):
+    import DrawPED
+    file_name = os.path.join(workdir, 'ped.csv')
+    make_ped_csv(file_name, params['pathways'])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ped_generator = DrawPED.PEDGenerator(file_name)
+    return ped_generator.gen_all_line_scatter_data
+
+
+def setup_ped_mpl(workdir, params):
+    import matplotlib.pyplot
+    import DrawPED
+    file_name = os.path.join(workdir, 'ped.csv')
+    make_ped_csv(file_name, params['pathways'])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ped_generator = DrawPED.PEDGenerator(file_name)
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            ped_generator.plot_with_mpl(file_name=os.path.join(workdir, 'PED.png'))
+            matplotlib.pyplot.close('all')
+    return run
+
+
+STAGES = {'poscar_parse': setup_poscar_parse,
+          'outcar_read': setup_outcar_read,
+          'outcar_extract': setup_outcar_extract,
+          'outcar_cached': setup_outcar_cached,
+          'vasprun_extract': setup_vasprun_extract,
+          'force_reduction': setup_force_reduction,
+          'log_write': setup_log_write,
+          'term_plot': setup_term_plot,
+          'mp_plot': setup_mp_plot,
+          'neb_band': setup_neb_band,
+          'neb_idpp': setup_neb_idpp,
+          'neb_idpp_ase': setup_neb_idpp_ase,
+          'neb_write': setup_neb_write,
+          'ped_load': setup_ped_load,
+          'ped_line_scatter': setup_ped_line_scatter,
+          'ped_mpl': setup_ped_mpl}
+
+
+## measurement
+def _status_kb(key):
+    #VmRSS / VmHWM of this process in kB, None off Linux
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def run_stage(name, workdir, params, repeat):
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    os.chdir(workdir)
+    run = STAGES[name](workdir, params)
+    wall, cpu = [], []
+    peak_kb = []
+    for i in range(repeat):
+        reset = _reset_peak_rss()
+        base_kb = _status_kb('VmRSS')
+        t0, c0 = time.perf_counter(), time.process_time()
+        run()
+        wall.append(time.perf_counter() - t0)
+        cpu.append(time.process_time() - c0)
+        hwm_kb = _status_kb('VmHWM')
+        if reset and hwm_kb is not None:
+            peak_kb.append(hwm_kb - base_kb)
+    return {'wall_s': min(wall), 'wall_median_s': float(np.median(wall)), 'cpu_s': min(cpu),
+            'peak_rss_mb': max(peak_kb)/1024 if peak_kb else None, 'repeat': repeat}
+
+
+def run_benchmarks(stage_list, params, repeat, workdir):
+    make_poscar(os.path.join(workdir, 'POSCAR'), params['atoms'], params['selective'])
+    make_outcar(os.path.join(workdir, 'OUTCAR'), params['atoms'], params['steps'], params['electronic'])
+    make_vasprun(os.path.join(workdir, 'vasprun.xml'), params['atoms'], params['steps'], params['electronic'])
+    results = {}
+    for name in stage_list:
+        #a fresh interpreter per stage, nothing is shared or pre-imported
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            try:
+                results[name] = pool.submit(run_stage, name, workdir, params, repeat).result()
+            except Exception as error:
+                results[name] = {'error': f'{type(error).__name__}: {error}'}
+        print(f'{name:>18}: ' + (f'{results[name]["wall_s"]:10.4f} s  peak {results[name]["peak_rss_mb"] or 0:9.1f} MB'
+                                 if 'error' not in results[name] else results[name]['error']))
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old_file):
+    with open(old_file) as file:
+        old = json.load(file)
+    print(f'\nCompared with {old_file} ({old["meta"].get("commit")}): new/old wall time')
+    for name, result in results.items():
+        previous = old['stages'].get(name, {})
+        if 'wall_s' in result and previous.get('wall_s'):
+            print(f'{name:>18}: {result["wall_s"]/previous["wall_s"]:7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parsing, reduction, output and plotting stages '
+                                                 'of vasp_plot_conv.py, neb_generate.py and DrawPED.py on synthetic inputs.')
+    parser.add_argument('-a', '--atoms', type=int, default=200,
+                        help='The number of atoms in the synthetic POSCAR/OUTCAR. [Optional] [default=200]')
+    parser.add_argument('-s', '--steps', type=int, default=100,
+                        help='The number of ionic steps in the synthetic OUTCAR. [Optional] [default=100]')
+    parser.add_argument('-e', '--electronic', type=int, default=10,
+                        help='The number of electronic steps per ionic step. [Optional] [default=10]')
+    parser.add_argument('--no_selective', action='store_true', default=False,
+                        help='Write the POSCAR without selective dynamics. [Optional]')
+    parser.add_argument('--neb_atoms', type=int, default=64,
+                        help='The number of slab atoms of the NEB endpoints. [Optional] [default=64]')
+    parser.add_argument('--neb_images', type=int, default=5,
+                        help='The number of NEB images. [Optional] [default=5]')
+    parser.add_argument('--pathways', type=int, default=200,
+                        help='The number of pathways in the synthetic PED csv. [Optional] [default=200]')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help='The stages to run. [Optional] [default=all]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs per stage, the fastest is reported. [Optional] [default=3]')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='The JSON result file. [Optional] [default=benchmark.json]')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='An earlier JSON result to compare with. [Optional]')
+    parser.add_argument('--workdir', default=None,
+                        help='Where the synthetic inputs are written, kept afterwards. [Optional] [default=temporary]')
+    args = parser.parse_args()
+
+    params = {'atoms': args.atoms, 'steps': args.steps, 'electronic': args.electronic,
+              'selective': not args.no_selective, 'neb_atoms': args.neb_atoms,
+              'neb_images': args.neb_images, 'pathways': args.pathways}
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='vasp_script_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run_benchmarks(args.stages, params, args.repeat, workdir)
+        outcar_mb = os.path.getsize(os.path.join(workdir, 'OUTCAR')) / 2**20
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'meta': {'commit': _git_commit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'python': platform.python_version(), 'numpy': np.__version__,
+                       'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                       'params': params, 'outcar_mb': outcar_mb},
+              'stages': results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f'Results written to {args.output}!')
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Measure the start-up latency of the scripts.
+
+Every entry point is run as a fresh subprocess, as a user would call it; the
+time to the first line on stdout and to the exit are recorded. The import cost
+of each script module is taken from `python -X importtime`, together with the
+heaviest packages it pulls in. Results go to a JSON file; --compare prints the
+ratio to an earlier result, e.g. of another commit.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+
+import numpy as np
+
+from benchmark import ROOT, make_poscar, make_outcar, make_neb_endpoints, make_ped_csv, _git_commit
+
+SCRIPTS = {'vasp_plot_conv': os.path.join(ROOT, 'vasp_plot_conv.py'),
+           'neb_generate': os.path.join(ROOT, 'neb_generate.py'),
+           'DrawPED': os.path.join(ROOT, 'DrawPED_Origin', 'DrawPED.py')}
+
+#name: arguments after the interpreter, run in the work directory holding the synthetic inputs
+ENTRY_POINTS = {'vasp_plot_conv_version': [SCRIPTS['vasp_plot_conv'], '-v'],
+                'vasp_plot_conv_help': [SCRIPTS['vasp_plot_conv'], '-h'],
+                'vasp_plot_conv_term': [SCRIPTS['vasp_plot_conv'], '--no_cache'],
+                'vasp_plot_conv_mp': [SCRIPTS['vasp_plot_conv'], '--no_cache', '-m', 'mp'],
+                'neb_generate_version': [SCRIPTS['neb_generate'], '-v'],
+                'neb_generate_help': [SCRIPTS['neb_generate'], '-h'],
+                'neb_generate_line': [SCRIPTS['neb_generate'], '-m', 'line', '-n', '3'],
+                'DrawPED_data': ['-c', 'import sys; sys.path.insert(0, sys.argv[1]); import DrawPED; '
+                                       'DrawPED.PEDGenerator("ped.csv").save_data("PED.data"); print("done")',
+                                 os.path.dirname(SCRIPTS['DrawPED'])]}
+
+
+def make_inputs(workdir, atoms, steps):
+    make_poscar(os.path.join(workdir, 'POSCAR'), atoms)
+    make_outcar(os.path.join(workdir, 'OUTCAR'), atoms, steps)
+    make_ped_csv(os.path.join(workdir, 'ped.csv'), 20)
+    initial, final = make_neb_endpoints(64)
+    for name, atoms in (('is', initial), ('fs', final)):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+        atoms.write(os.path.join(workdir, name, 'CONTCAR'), format='vasp', direct=True)
+
+
+def time_entry_point(arguments, workdir, repeat):
+    env = {**os.environ, 'MPLBACKEND': 'Agg'}
+    first, total = [], []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + arguments, cwd=workdir, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        line = process.stdout.readline()
+        t_first = time.perf_counter() - t0
+        process.stdout.read()
+        returncode = process.wait()
+        total.append(time.perf_counter() - t0)
+        #no output at all: the exit is the first thing the user sees
+        first.append(t_first if line else total[-1])
+    return {'first_output_s': min(first), 'first_output_median_s': float(np.median(first)),
+            'total_s': min(total), 'returncode': returncode, 'repeat': repeat}
+
+
+def _import_times(code):
+    #cumulative import time of the packages up to one level deep (nesting is shown by two more spaces per level)
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if len(fields[2]) - len(fields[2].lstrip()) <= 3:
+            packages[fields[2].strip()] = int(fields[1]) / 1e6
+    return packages
+
+
+def time_import(name, n_heaviest=5):
+    #import time of the script module and the heaviest packages it pulls in (not those of the interpreter start-up)
+    script_dir = os.path.dirname(SCRIPTS[name])
+    packages = _import_times(f'import sys; sys.path.insert(0, {script_dir!r}); import {name}')
+    interpreter = _import_times('pass')
+    heaviest = sorted(((k, v) for k, v in packages.items() if k != name and k not in interpreter), key=lambda i: -i[1])
+    return {'import_s': packages.get(name), 'heaviest': heaviest[:n_heaviest]}
+
+
+def compare(results, old_file):
+    with open(old_file) as file:
+        old = json.load(file)
+    print(f'\nCompared with {old_file} ({old["meta"].get("commit")}): new/old time to first output')
+    for name, result in results['entry_points'].items():
+        previous = old['entry_points'].get(name, {})
+        if previous.get('first_output_s'):
+            print(f'{name:>24}: {result["first_output_s"]/previous["first_output_s"]:7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the import time and the latency to the first output '
+                                                 'of every entry point of vasp_plot_conv.py, neb_generate.py and DrawPED.py.')
+    parser.add_argument('-a', '--atoms', type=int, default=50,
+                        help='The number of atoms in the synthetic POSCAR/OUTCAR. [Optional] [default=50]')
+    parser.add_argument('-s', '--steps', type=int, default=10,
+                        help='The number of ionic steps in the synthetic OUTCAR. [Optional] [default=10]')
+    parser.add_argument('--entry_points', nargs='+', choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS),
+                        help='The entry points to run. [Optional] [default=all]')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per entry point, the fastest is reported. [Optional] [default=5]')
+    parser.add_argument('-o', '--output', default='startup.json',
+                        help='The JSON result file. [Optional] [default=startup.json]')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='An earlier JSON result to compare with. [Optional]')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vasp_script_startup_')
+    try:
+        make_inputs(workdir, args.atoms, args.steps)
+        results = {'entry_points': {}, 'imports': {}}
+        for name in args.entry_points:
+            results['entry_points'][name] = result = time_entry_point(ENTRY_POINTS[name], workdir, args.repeat)
+            print(f'{name:>24}: first output {result["first_output_s"]:7.3f} s  exit {result["total_s"]:7.3f} s'
+                  + (f'  (exit code {result["returncode"]})' if result['returncode'] else ''))
+        for name in SCRIPTS:
+            results['imports'][name] = result = time_import(name)
+            print(f'{"import " + name:>24}: {result["import_s"] or 0:7.3f} s  heaviest: '
+                  + ', '.join(f'{k} {v:.3f}' for k, v in result['heaviest']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'meta': {'commit': _git_commit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'params': {'atoms': args.atoms, 'steps': args.steps}},
+              **results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f'Results written to {args.output}!')
+    if args.compare:
+        compare(results, args.compare)
@@ -2,85 +2,493 @@
 # coding: utf-8
 __author__ = 'wankw (wankaiweii@gmail.com)' 
 
-from ase.neb import NEB
-from ase.io import read
-from ase.io import write
 import numpy as np
 from numpy.linalg import norm
+from io import StringIO
+from functools import partial
+from itertools import product
+from contextlib import redirect_stdout
+import contextlib
+import csv
+import shutil
 import os
+#ase and scipy are imported inside the functions using them, so --help/--version and argument errors return at once
+
+def get_neb_class():
+    try:
+        from ase.mep import NEB
+    except ImportError:
+        #ASE < 3.23
+        from ase.neb import NEB
+    return NEB
+
+def get_mic_displacement(initial, final):
+    #is->fs displacement of every atom and the lattice shift (in cell vectors) of its minimum image,
+    #searched over the neighbouring cells so it also holds for skewed (triclinic) cells
+    from ase.geometry import find_mic
+    cell = initial.get_cell()[:]
+    D = final.get_positions() - initial.get_positions()
+    D_mic, _ = find_mic(D, cell, initial.get_pbc())
+    shift = np.rint((D_mic - D) @ np.linalg.inv(cell)).astype(int)
+    return D, shift
+
+def print_displacement(D, n_top=5):
+    d = norm(D, axis=1)
+    print (f'Distance between is&fs is {norm(d)}!')
+    print (f'Per-atom displacement: max {d.max():.4f}, mean {d.mean():.4f}, rms {np.sqrt((d**2).mean()):.4f}, '
+           f'{(d > 0.1).sum()} of {len(d)} atoms move more than 0.1 A')
+    top = np.argsort(d)[::-1][:n_top]
+    print ('Largest movements: ' + ', '.join(f'atom {i+1} {d[i]:.4f}' for i in top))
 
 def check_move_far(initial,final):
+    D, shift = get_mic_displacement(initial, final)
+    print_displacement(D)
+
     is_pos = initial.get_scaled_positions(wrap=False)
     fs_pos = final.get_scaled_positions(wrap=False)
-    dist = norm(list(map(norm, (is_pos - fs_pos)@initial.get_cell()[:])))
-    print (f'Distance between is&fs is {dist}!')
+    for i in np.flatnonzero(shift.any(axis=1)):
+        print (f'Movement of atom {i+1} is too far! Check it! is: {is_pos[i]} --> fs: {fs_pos[i]}, shortest image is {shift[i]} cells away')
+    return shift
 
-    n = 0
-    far_id_list = np.argwhere(abs(is_pos-fs_pos)>0.5)
+def wrap_atoms_by_id(shift, init_atoms, fin_atoms):
+    #move the fs atoms to the minimum image of their is position
+    pos_fs = fin_atoms.get_scaled_positions(wrap=False) + shift
 
-    for i in far_id_list:
-        print (f'Movement of atom {i[0]+1} is too far! Check it! is: {is_pos[i[0]]} --> fs: {fs_pos[i[0]]}')
-    return far_id_list
+    fin_wrap_atoms = fin_atoms.copy()
+    fin_wrap_atoms.set_scaled_positions(pos_fs)
+    return init_atoms.copy(), fin_wrap_atoms
 
-def wrap_atoms_by_id(far_id_list, init_atoms, fin_atoms):
-    pos_is = init_atoms.get_scaled_positions(wrap=False)
-    pos_fs = fin_atoms.get_scaled_positions(wrap=False)
-    
-    for i in far_id_list:
-        if pos_is[i[0]][i[1]] > pos_fs[i[0]][i[1]]:
-            pos_fs[i[0]][i[1]] = pos_fs[i[0]][i[1]]+1
-        elif pos_is[i[0]][i[1]] < pos_fs[i[0]][i[1]]:
-            pos_is[i[0]][i[1]] = pos_is[i[0]][i[1]]+1
+def match_atoms(initial, final, k=8):
+    #optimal per-species correspondence fs -> is: the k nearest periodic images of fs atoms (kd-tree) around
+    #each is atom give a sparse cost matrix (squared distance), solved by linear assignment; returns perm so
+    #that final[perm] lines up with initial
+    from scipy.spatial import cKDTree
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+    symbols_is = np.array(initial.get_chemical_symbols())
+    symbols_fs = np.array(final.get_chemical_symbols())
+    if sorted(symbols_is) != sorted(symbols_fs):
+        raise ValueError('is and fs have different compositions!')
+    cell = initial.get_cell()[:]
+    shifts = np.array(list(product(*[(-1, 0, 1) if p else (0,) for p in initial.get_pbc()]))) @ cell
+    pos_is, pos_fs = initial.get_positions(), final.get_positions()
+    perm = np.empty(len(initial), dtype=int)
+    for symbol in np.unique(symbols_is):
+        id_is, id_fs = np.flatnonzero(symbols_is == symbol), np.flatnonzero(symbols_fs == symbol)
+        n = len(id_is)
+        tree = cKDTree((pos_fs[id_fs] + shifts[:, None]).reshape(-1, 3))
+        n_neighbor = min(k, n)
+        while n_neighbor < n:
+            d, j = tree.query(pos_is[id_is], n_neighbor)
+            rows, cols, cost = np.repeat(np.arange(n), n_neighbor), j.ravel() % n, d.ravel()**2 + 1
+            #several images of one fs atom: keep the nearest
+            order = np.lexsort((cost, cols, rows))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = (np.diff(rows[order]) != 0) | (np.diff(cols[order]) != 0)
+            order = order[first]
+            try:
+                col = min_weight_full_bipartite_matching(csr_matrix((cost[order], (rows[order], cols[order])), shape=(n, n)))[1]
+                break
+            except ValueError:
+                #no complete matching among the nearest candidates, widen the search
+                n_neighbor *= 4
+        else:
+            cost = np.min([(((pos_is[id_is, None] - pos_fs[id_fs] - shift))**2).sum(axis=-1) for shift in shifts], axis=0)
+            col = linear_sum_assignment(cost)[1]
+        perm[id_is] = id_fs[col]
+    return perm
 
-    init_wrap_atoms = init_atoms.copy()
-    init_wrap_atoms.set_scaled_positions(pos_is)
+def write_image(i, image, directory='.', movie_format='xyz', poscar_xyz=False):
+    #serialize the image once in memory, the xyz text is reused for the movie
+    from ase.io import write
+    poscar, xyz = StringIO(), StringIO()
+    write(poscar, image, format='vasp', vasp5=True, direct=True)
+    write(xyz, image, format=movie_format)
+    image_dir = os.path.join(directory, f'{i:02}')
+    os.makedirs(image_dir, exist_ok=True)
+    with open(os.path.join(image_dir, 'POSCAR'), 'w') as poscar_file:
+        poscar_file.write(poscar.getvalue())
+    if poscar_xyz:
+        with open(os.path.join(image_dir, 'POSCAR.xyz'), 'w') as xyz_file:
+            xyz_file.write(xyz.getvalue())
+    return xyz.getvalue()
 
-    fin_wrap_atoms = fin_atoms.copy()
-    fin_wrap_atoms.set_scaled_positions(pos_fs)
-    return init_wrap_atoms, fin_wrap_atoms
+def write_images(images, method, directory='.', movie_format='xyz', trajectory=None, poscar_xyz=False, jobs=None):
+    #generate 00..NN/POSCAR in parallel (threads overlap the small writes on network filesystems) and movie_{method}.xyz
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(jobs) as executor:
+        movie = list(executor.map(partial(write_image, directory=directory, movie_format=movie_format, poscar_xyz=poscar_xyz),
+                                  range(len(images)), images))
+    with open(os.path.join(directory, f'movie_{method}.xyz'), 'w') as movie_xyz:
+        movie_xyz.write(''.join(movie))
+    if trajectory:
+        from ase.io import write
+        write(os.path.join(directory, trajectory), images)
 
-def linear_interpolation():
+def linear_interpolation(initial, final, n_image):
     images = [initial.copy() for i in range(n_image+1)] + [final]
     #linearly_interpolates
-    neb = NEB(images)
+    neb = get_neb_class()(images, method='improvedtangent')
     neb.interpolate()
-    #generate POSCAR and movie.xyz
-    movie = []
-    for i in range(len(images)):
-        if not os.path.isdir(f'{i:02}'):
-            os.mkdir(f'{i:02}')
-        images[i].write(f'{i:02}/POSCAR',vasp5=True,direct=True)
-        images[i].write(f'{i:02}/POSCAR.xyz', format='xyz')
-        with open(f'{i:02}/POSCAR.xyz') as xyz_file:
-            line = xyz_file.readline()
-            while line:
-                movie.append(line)
-                line = xyz_file.readline()
-                
-    with open('movie_line.xyz','w') as movie_xyz:
-        movie_xyz.writelines(movie)
+    return images
 
 #Reference: S. Smidstrup, A. Pedersen, K. Stokbro and H. Jonsson, Improved initial guess for minimum energy path calculations, J. Chem. Phys. 140, 214106 (2014).
-def idpp_interpolation():
+def get_frozen_mask(atoms):
+    #atoms fixed in all three directions by selective dynamics (read by ase as FixAtoms)
+    from ase.constraints import FixAtoms
+    frozen = np.zeros(len(atoms), dtype=bool)
+    for constraint in atoms.constraints:
+        if isinstance(constraint, FixAtoms):
+            frozen[constraint.get_indices()] = True
+    return frozen
+
+def get_idpp_pairs(initial, final, moving, cutoff):
+    #pairs (i<j, at least one moving atom) closer than cutoff in is or fs, with the lattice shift of j;
+    #cutoff <= 0 takes every pair with its minimum image in is
+    from ase.geometry import find_mic
+    from ase.neighborlist import neighbor_list
+    cell = initial.get_cell()[:]
+    pair_list = []
+    for atoms in ((initial, final) if cutoff > 0 else (initial,)):
+        pos = atoms.get_positions()
+        if cutoff > 0:
+            i, j, D = neighbor_list('ijD', atoms, cutoff)
+        else:
+            i, j = np.triu_indices(len(atoms), 1)
+            D, _ = find_mic(pos[j] - pos[i], cell, atoms.get_pbc())
+        shift = np.rint((D - (pos[j] - pos[i])) @ np.linalg.inv(cell)).astype(int)
+        pair_list.append(np.column_stack((i, j, shift)))
+    pairs = np.unique(np.concatenate(pair_list), axis=0)
+    pairs = pairs[(pairs[:, 0] < pairs[:, 1]) & (moving[pairs[:, 0]] | moving[pairs[:, 1]])]
+    return pairs[:, 0], pairs[:, 1], pairs[:, 2:] @ cell
+
+def unique_image_radius(cell, pbc):
+    #a vector shorter than half the shortest lattice vector is its own minimum image
+    from ase.geometry.minkowski_reduction import minkowski_reduce
+    if not np.any(pbc):
+        return np.inf
+    rcell, op = minkowski_reduce(cell, pbc)
+    return 0.5 * norm(rcell[np.asarray(pbc)], axis=1).min()
+
+def idpp_native(images, cutoff=5.0, fmax=0.1, steps=100, k=0.1, dt=0.2, maxstep=0.2):
+    #all interior images are optimized at once as a (n_image, n_atom, 3) array:
+    #idpp forces on the neighbour pairs, ase-style NEB projection and a global MDMin
+    from ase.geometry import find_mic
+    moving = ~get_frozen_mask(images[0])
+    i, j, shift = get_idpp_pairs(images[0], images[-1], moving, cutoff)
+    pos = np.array([image.get_positions() for image in images])
+    n_image, n_atom = len(images) - 2, len(images[0])
+    cell, pbc = images[0].get_cell()[:], images[0].get_pbc()
+    d_is = norm(pos[0, j] - pos[0, i] + shift, axis=-1)
+    if cutoff > 0:
+        #the pairs are the periodic images found within cutoff, kept as they are
+        d_fs = norm(pos[-1, j] - pos[-1, i] + shift, axis=-1)
+        radius = np.inf
+    else:
+        #every pair at its minimum image in every image, as ase idpp(mic=True); the image of a pair is
+        #looked up again whenever it is too long to be sure it is still the nearest one
+        d_fs = find_mic(pos[-1, j] - pos[-1, i], cell, pbc)[1]
+        shift = np.repeat(shift[None], n_image, axis=0)
+        radius = unique_image_radius(cell, pbc)
+    target = d_is + np.linspace(0, 1, len(images))[1:-1, None] * (d_fs - d_is)
+    offset = (np.arange(n_image) * n_atom)[:, None]
+
+    def get_forces(R):
+        R_ij = R[:, j] - R[:, i]
+        D = R_ij + shift
+        d = norm(D, axis=-1)
+        far = d >= radius
+        if far.any():
+            D[far], d[far] = find_mic(D[far], cell, pbc)
+            shift[far] = D[far] - R_ij[far]
+        dd = d - target
+        energy = (dd**2 / d**4).sum(axis=1)
+        g = (2 * dd * (1 - 2 * dd / d) / d**5)[..., None] * D
+        force = np.empty((n_image, n_atom, 3))
+        for c in range(3):
+            force[..., c] = (np.bincount((offset + i).ravel(), g[..., c].ravel(), n_image * n_atom)
+                             - np.bincount((offset + j).ravel(), g[..., c].ravel(), n_image * n_atom)).reshape(n_image, n_atom)
+        force[:, ~moving] = 0
+        #improved tangent (Henkelman & Jonsson, J. Chem. Phys. 113, 9978 (2000)), as ase NEB(method='improvedtangent')
+        full = np.concatenate((pos[:1], R, pos[-1:]))
+        t1, t2 = full[1:-1] - full[:-2], full[2:] - full[1:-1]
+        e = np.concatenate(([0], energy, [0]))
+        e_prev, e_next = e[:-2] - energy, e[2:] - energy
+        up, down = (e_next > 0) & (e_prev < 0), (e_next < 0) & (e_prev > 0)
+        dv_max = np.maximum(abs(e_next), abs(e_prev))
+        dv_min = np.minimum(abs(e_next), abs(e_prev))
+        w2 = np.where(up, 1, np.where(down, 0, np.where(e_next > e_prev, dv_max, dv_min)))
+        w1 = np.where(up, 0, np.where(down, 1, np.where(e_next > e_prev, dv_min, dv_max)))
+        tangent = w2[:, None, None] * t2 + w1[:, None, None] * t1
+        tangent_norm = norm(tangent.reshape(n_image, -1), axis=1)
+        tangent /= np.where(tangent_norm > 0, tangent_norm, 1)[:, None, None]
+        spring = k * (norm(t2.reshape(n_image, -1), axis=1) - norm(t1.reshape(n_image, -1), axis=1))
+        projection = np.einsum('ijk,ijk->i', force, tangent)
+        return force + (spring - projection)[:, None, None] * tangent
+
+    R = pos[1:-1].copy()
+    v = None
+    for step in range(steps + 1):
+        f = get_forces(R)
+        if np.sqrt((f**2).sum(axis=-1)).max() < fmax or step == steps:
+            break
+        if v is None:
+            v = np.zeros_like(R)
+        else:
+            v += 0.5 * dt * f
+            vf = np.vdot(v, f)
+            v = f * vf / np.vdot(f, f) if vf > 0 else np.zeros_like(R)
+        v += 0.5 * dt * f
+        dR = dt * v
+        dR *= min(1.0, maxstep / (1e-6 + np.sqrt((dR**2).sum(axis=-1)).max()))
+        R += dR
+
+    for image, positions in zip(images[1:-1], R):
+        image.set_positions(positions)
+    return step
+
+def idpp_interpolation(initial, final, n_image, engine='native', cutoff=5.0, fmax=0.1, steps=100):
     images = [initial.copy() for i in range(n_image+1)] + [final]
     #idpp_interpolates
-    neb = NEB(images)
-    neb.interpolate('idpp')
-    #generate POSCAR and movie.xyz
-    movie = []
-    for i in range(len(images)):
-        if not os.path.isdir(f'{i:02}'):
-            os.mkdir(f'{i:02}')
-        images[i].write(f'{i:02}/POSCAR',vasp5=True,direct=True)
-        images[i].write(f'{i:02}/POSCAR.xyz', format='xyz')
-        with open(f'{i:02}/POSCAR.xyz') as xyz_file:
-            line = xyz_file.readline()
-            while line:
-                movie.append(line)
-                line = xyz_file.readline()
-                
-    with open('movie_idpp.xyz','w') as movie_xyz:
-        movie_xyz.writelines(movie)
+    neb = get_neb_class()(images, method='improvedtangent')
+    if engine == 'ase':
+        neb.interpolate('idpp')
+        return images, None
+    neb.interpolate()
+    n_step = idpp_native(images, cutoff, fmax, steps)
+    print (f'idpp converged in {n_step} steps.' if n_step < steps else f'idpp not converged (fmax={fmax}) in {steps} steps!')
+    return images, n_step
+
+def generate_neb(initial_file, final_file, n_image=5, method='idpp', directory='.', wrap=True, match=False,
+                 engine='native', cutoff=5.0, fmax=0.1, steps=100, movie_format='xyz', trajectory=None,
+                 poscar_xyz=False, jobs=None, stage=contextlib.nullcontext):
+    #the whole check/wrap/interpolate/write pipeline for one reaction, returns a summary row;
+    #every step runs in stage(name), e.g. a StageProfile of --profile
+    from ase.io import read
+    with stage('read_structures'):
+        initial = read(initial_file)
+        final = read(final_file)
+    row = {'n_permuted': 0, 'n_far': 0, 'idpp_steps': None, 'warnings': []}
+
+    #the scipy matching runs only when asked for, or to explain atoms that move too far
+    if match:
+        with stage('match'):
+            perm = match_atoms(initial, final)
+        row['n_permuted'] = int((perm != np.arange(len(perm))).sum())
+        if row['n_permuted']:
+            final = final[perm]
+            print (f'Reorder {row["n_permuted"]} atoms of fs to match is!\n')
+            row['warnings'].append(f'reordered {row["n_permuted"]} atoms')
+
+    with stage('check_far'):
+        far_shift = check_move_far(initial, final)
+    row['n_far'] = int(far_shift.any(axis=1).sum())
+    if row['n_far'] and not match:
+        with stage('match'):
+            perm = match_atoms(initial, final)
+        row['n_permuted'] = int((perm != np.arange(len(perm))).sum())
+        if row['n_permuted']:
+            print (f'{row["n_permuted"]} atoms of fs seem to be permuted relative to is, check it or rerun with --match!\n')
+            row['warnings'].append(f'{row["n_permuted"]} atoms look permuted')
+    if row['n_far'] and wrap:
+        initial, final = wrap_atoms_by_id(far_shift, initial, final)
+        print ('\nAfter wrap!')
+        print_displacement(final.get_positions() - initial.get_positions())
+        row['warnings'].append(f'wrapped {row["n_far"]} atoms')
+    elif row['n_far']:
+        row['warnings'].append(f'{row["n_far"]} atoms move too far')
+    d = norm(final.get_positions() - initial.get_positions(), axis=1)
+    row['distance'], row['max_displacement'] = float(norm(d)), float(d.max())
+
+    if method == 'line':
+        with stage('interpolate'):
+            images = linear_interpolation(initial, final, n_image)
+    elif method == 'idpp':
+        with stage('idpp'):
+            images, row['idpp_steps'] = idpp_interpolation(initial, final, n_image, engine, cutoff, fmax, steps)
+        if row['idpp_steps'] == steps:
+            row['warnings'].append('idpp not converged')
+    else:
+        raise ValueError(f'unknown interpolation method {method}')
+    os.makedirs(directory, exist_ok=True)
+    with stage('write_images'):
+        write_images(images, method, directory, movie_format, trajectory, poscar_xyz, jobs)
+
+    print (f'Generate {n_image} images between {initial_file} & {final_file} by {method} interpolation!')
+    return row
+
+## resample an existing band
+def read_band(directory='.'):
+    #images 00..NN (CONTCAR if present, else POSCAR) and their final OUTCAR energies (nan if missing)
+    from ase.io import read
+    from vasp_plot_conv import read_final_energy
+    names = sorted((i for i in os.listdir(directory) if i.isdigit() and os.path.isdir(os.path.join(directory, i))), key=int)
+    if len(names) < 2 or [int(i) for i in names] != list(range(len(names))):
+        raise ValueError(f'no complete band of image directories 00..NN in {directory}!')
+    images, energies = [], []
+    for name in names:
+        image_dir = os.path.join(directory, name)
+        contcar = os.path.join(image_dir, 'CONTCAR')
+        images.append(read(contcar if os.path.isfile(contcar) and os.path.getsize(contcar) else os.path.join(image_dir, 'POSCAR')))
+        outcar = os.path.join(image_dir, 'OUTCAR')
+        energies.append(read_final_energy(outcar) if os.path.isfile(outcar) and os.path.getsize(outcar) else np.nan)
+    return images, np.array(energies)
+
+def resample_band(images, energies, n_image, density=0.0, width=0.1, kind='linear'):
+    #new band of n_image images equally spaced in arc length along the old one; density > 0 puts
+    #(1+density) times more images around the highest-energy image (gaussian of the given width in arc length)
+    from ase.geometry import find_mic
+    cell, pbc = images[0].get_cell()[:], images[0].get_pbc()
+    P = np.array([image.get_positions() for image in images])
+    #CONTCARs may be wrapped, follow every atom along the band by minimum image
+    for k in range(1, len(P)):
+        P[k] = P[k-1] + find_mic(P[k] - P[k-1], cell, pbc)[0]
+    s = np.concatenate(([0], np.cumsum(norm((P[1:] - P[:-1]).reshape(len(P)-1, -1), axis=1))))
+    length = s[-1]
+    if length == 0:
+        raise ValueError('all images of the band are identical, nothing to resample!')
+    s /= length
+
+    u = np.linspace(0, 1, n_image+2)
+    i_max = None
+    if density > 0 and np.isfinite(energies[1:-1]).any():
+        i_max = 1 + np.nanargmax(energies[1:-1])
+        grid = np.linspace(0, 1, 2001)
+        weight = 1 + density * np.exp(-0.5 * ((grid - s[i_max]) / width)**2)
+        cumulative = np.concatenate(([0], np.cumsum((weight[1:] + weight[:-1]) / 2)))
+        u = np.interp(u, cumulative / cumulative[-1], grid)
+    elif density > 0:
+        print ('No OUTCAR energies of the images, resample uniformly!')
+
+    if kind == 'cubic':
+        from scipy.interpolate import CubicSpline
+        #the spline needs strictly increasing knots: merge identical adjacent images
+        keep = np.concatenate(([True], np.diff(s) > 0))
+        if not keep.all():
+            print (f'Merge {(~keep).sum()} images identical to their predecessor for the cubic path!')
+        P_new = CubicSpline(s[keep], P[keep], axis=0)(u)
+    else:
+        index = np.clip(np.searchsorted(s, u, side='right') - 1, 0, len(s) - 2)
+        segment = s[index+1] - s[index]
+        frac = np.where(segment > 0, (u - s[index]) / np.where(segment > 0, segment, 1), 0)
+        P_new = P[index] + frac[:, None, None] * (P[index+1] - P[index])
+
+    new_images = [images[0].copy()]
+    for positions in P_new[1:-1]:
+        image = images[0].copy()
+        image.set_positions(positions)
+        new_images.append(image)
+    new_images.append(images[-1].copy())
+    return new_images, length, i_max
+
+def resample(band_dir, n_image, directory='resampled', density=0.0, width=0.1, kind='linear',
+             movie_format='xyz', trajectory=None, poscar_xyz=False, jobs=None, stage=contextlib.nullcontext):
+    if os.path.abspath(band_dir) == os.path.abspath(directory):
+        raise ValueError('write the resampled band into another directory than the old one!')
+    with stage('read_band'):
+        images, energies = read_band(band_dir)
+    with stage('resample_band'):
+        new_images, length, i_max = resample_band(images, energies, n_image, density, width, kind)
+    os.makedirs(directory, exist_ok=True)
+    with stage('write_images'):
+        write_images(new_images, 'resample', directory, movie_format, trajectory, poscar_xyz, jobs)
+    #the endpoint OUTCARs are needed by the NEB tools of the new band
+    for old, new in ((0, 0), (len(images)-1, n_image+1)):
+        outcar = os.path.join(band_dir, f'{old:02}', 'OUTCAR')
+        if os.path.isfile(outcar):
+            shutil.copy(outcar, os.path.join(directory, f'{new:02}', 'OUTCAR'))
+    print (f'Path length of the old band is {length:.4f} A' + (f', highest image is {i_max:02}' if i_max is not None else '') + '.')
+    print (f'Resample {len(images)-2} images of {band_dir} to {n_image} images in {directory}!')
+
+## batch set-up from a manifest
+def read_manifest(file_name):
+    #csv with a header, or a yaml list of mappings; keys initial, final and optionally n_image, method,
+    #directory (default: the common parent of initial and final) and name. Paths are relative to the manifest.
+    #An invalid entry is kept with its error, so it fails alone in the batch report.
+    if file_name.endswith(('.yaml', '.yml')):
+        import yaml
+        with open(file_name) as file:
+            entries = yaml.safe_load(file)
+        if isinstance(entries, dict):
+            entries = entries.get('reactions', [])
+    else:
+        with open(file_name, newline='') as file:
+            #skip blank lines only
+            entries = [i for i in csv.DictReader(file, skipinitialspace=True)
+                       if any(isinstance(v, str) and v.strip() for v in i.values())]
+    root = os.path.dirname(os.path.abspath(file_name))
+    reactions = []
+    for n, entry in enumerate(entries or []):
+        try:
+            reactions.append(read_manifest_entry(entry, root))
+        except (ValueError, TypeError, AttributeError) as error:
+            name = entry.get('name') if isinstance(entry, dict) else None
+            reactions.append({'name': str(name or f'entry {n+1}'),
+                              'error': f'invalid manifest entry {n+1}: ' + ' '.join(str(error).split())})
+    return reactions
+
+def read_manifest_entry(entry, root):
+    if not isinstance(entry, dict):
+        raise TypeError(f'expected a mapping, got {entry!r}')
+    entry = {str(k).strip(): (v.strip() if isinstance(v, str) else v) for k, v in entry.items() if k is not None and v not in (None, '')}
+    missing = [i for i in ('initial', 'final') if i not in entry]
+    if missing:
+        raise ValueError(f'no {" and ".join(missing)} given')
+    reaction = {'initial_file': os.path.join(root, str(entry['initial'])), 'final_file': os.path.join(root, str(entry['final']))}
+    reaction['directory'] = os.path.join(root, str(entry['directory'])) if 'directory' in entry else \
+        os.path.commonpath([os.path.dirname(reaction['initial_file']), os.path.dirname(reaction['final_file'])])
+    if 'n_image' in entry:
+        reaction['n_image'] = int(entry['n_image'])
+        if reaction['n_image'] < 1:
+            raise ValueError(f'n_image must be positive, got {reaction["n_image"]}')
+    if 'method' in entry:
+        if entry['method'] not in ('idpp', 'line'):
+            raise ValueError(f'unknown interpolation method {entry["method"]}')
+        reaction['method'] = entry['method']
+    reaction['name'] = str(entry.get('name', os.path.relpath(reaction['directory'], root)))
+    return reaction
+
+def generate_reaction(reaction, options):
+    #one manifest entry in a worker; the messages go to DIRECTORY/neb_generate.log, errors into the row
+    kwargs = {**options, **reaction}
+    name = kwargs.pop('name')
+    if 'error' in kwargs:
+        #rejected by read_manifest
+        return {'error': kwargs['error'], 'name': name, 'n_image': kwargs['n_image'], 'method': kwargs['method']}
+    log = StringIO()
+    try:
+        with redirect_stdout(log):
+            row = generate_neb(**kwargs)
+        row['error'] = ''
+    except Exception as error:
+        row = {'error': f'{type(error).__name__}: ' + ' '.join(str(error).split())}
+    if os.path.isdir(kwargs['directory']):
+        with open(os.path.join(kwargs['directory'], 'neb_generate.log'), 'w') as log_file:
+            log_file.write(log.getvalue() + (row['error'] + '\n' if row['error'] else ''))
+    row.update(name=name, n_image=kwargs['n_image'], method=kwargs['method'])
+    return row
+
+def generate_batch(reactions, options, n_worker=None):
+    n_worker = min(n_worker or os.cpu_count() or 1, len(reactions))
+    if n_worker <= 1:
+        return [generate_reaction(i, options) for i in reactions]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(n_worker) as pool:
+        return list(pool.map(generate_reaction, reactions, [options]*len(reactions)))
+
+def print_summary(rows):
+    width = max([len(i['name']) for i in rows] + [8])
+    print (f'{"reaction":<{width}} {"images":>6} {"method":>6} {"dist/A":>8} {"max/A":>8} {"steps":>5}  warnings')
+    for row in rows:
+        if row['error']:
+            print (f'{row["name"]:<{width}} {row["n_image"]:>6} {row["method"]:>6} {"FAILED":>8} {"":>8} {"":>5}  {row["error"]}')
+            continue
+        steps = '' if row['idpp_steps'] is None else row['idpp_steps']
+        print (f'{row["name"]:<{width}} {row["n_image"]:>6} {row["method"]:>6} {row["distance"]:8.3f} '
+               f'{row["max_displacement"]:8.3f} {steps:>5}  {"; ".join(row["warnings"])}')
+    n_failed = sum(1 for i in rows if i['error'])
+    print (f'\n{len(rows) - n_failed} of {len(rows)} reactions generated' + (f', {n_failed} failed!' if n_failed else '!'))
         
 def get_version():
     return '1.0 (2020.12.8, wankaiweii@gmail.com)'
@@ -103,28 +511,70 @@ if __name__ == '__main__':
                         help='The number of interpolation. [Optional] [default=5]')
     parser.add_argument('-w','--wrap_tag', type=bool, action='store', default=True,
                         help='Wrap positions or not. [Optional] [default=True]')
+    parser.add_argument('--match', action='store_true',
+                        help='Reorder the fs atoms to the optimal per-species correspondence with is before interpolation. [Optional]')
+    parser.add_argument('--movie_format', type=str, action='store', choices={'xyz','extxyz'}, default='xyz',
+                        help='Format of movie_{line,idpp}.xyz, extxyz keeps the cell and the selective dynamics flags. [Optional] [default="xyz"]')
+    parser.add_argument('-t','--trajectory', type=str, action='store', default=None,
+                        help='Also write all images to this ase trajectory (e.g. neb.traj). [Optional] [default=None]')
+    parser.add_argument('--poscar_xyz', action='store_true',
+                        help='Also write NN/POSCAR.xyz for every image. [Optional]')
+    parser.add_argument('-j','--jobs', type=int, action='store', default=None,
+                        help='Threads writing the image directories, or worker processes with --batch. [Optional] [default=python default / cpu count]')
+    parser.add_argument('-b','--batch', type=str, action='store', default=None,
+                        help='Manifest (.csv or .yaml) of reactions with columns initial, final and optionally n_image, method, directory, name; '
+                             'all are set up in parallel and a summary is printed. [Optional]')
+    parser.add_argument('-r','--resample', type=str, action='store', default=None,
+                        help='Read the band 00..NN (CONTCAR, else POSCAR) in this directory and write NUMBER_OF_IMAGES images '
+                             'equally spaced in arc length along it to --output_dir, instead of interpolating is & fs. [Optional]')
+    parser.add_argument('-o','--output_dir', type=str, action='store', default='resampled',
+                        help='Where --resample writes the new band. [Optional] [default="resampled"]')
+    parser.add_argument('--density', type=float, action='store', default=0.0,
+                        help='With --resample, put up to 1+DENSITY times more images around the highest-energy image (by OUTCAR). [Optional] [default=0]')
+    parser.add_argument('--density_width', type=float, action='store', default=0.1,
+                        help='Width of that region as a fraction of the path length. [Optional] [default=0.1]')
+    parser.add_argument('--resample_kind', type=str, action='store', choices={'linear','cubic'}, default='linear',
+                        help='Piecewise linear or cubic spline path through the old images. [Optional] [default="linear"]')
+    parser.add_argument('-e','--idpp_engine', type=str, action='store', choices={'native','ase'}, default='native',
+                        help='Optimize all idpp images at once with numpy over neighbour pairs (native), or use ase NEB.interpolate("idpp"). [Optional] [default="native"]')
+    parser.add_argument('-c','--idpp_cutoff', type=float, action='store', default=5.0,
+                        help='Only atom pairs closer than this (in is or fs) enter the native idpp; 0 takes all pairs at their minimum image, as ase idpp(mic=True). Pairs of two frozen atoms are always skipped. [Optional] [default=5.0]')
+    parser.add_argument('--fmax', type=float, action='store', default=0.1,
+                        help='Force tolerance of the idpp optimization in eV/A. [Optional] [default=0.1]')
+    parser.add_argument('--steps', type=int, action='store', default=100,
+                        help='Maximum number of idpp optimization steps. [Optional] [default=100]')
+    parser.add_argument('--profile', type=str, action='store', nargs='?', const='neb_generate_profile.json', default=None,
+                        help='Record wall/CPU time, bytes read/written and peak memory of every stage (generate_neb with read_structures, '
+                             'match, check_far, interpolate/idpp, write_images; resample with read_band, resample_band, write_images '
+                             'with -r; read_manifest, batch with -b) into this JSON report. [Optional] [default=neb_generate_profile.json]')
+    parser.add_argument('--cprofile', type=str, action='store', default=None,
+                        help='Also run this stage of --profile under cProfile, dumped to profile_STAGE.prof. [Optional] [default=None]')
     
     
     args = parser.parse_args()
-    
-    initial_ini = read(rf'{args.initial_state_carfile}')
-    final_ini = read(rf'{args.final_state_carfile}')
-    n_image = args.number_of_images
-    interpolation_method = args.interpolation_method
-    wrap_tag = args.wrap_tag
-   
-    far_id_list = check_move_far(initial_ini, final_ini)
-    if far_id_list.any() and wrap_tag:
-        initial, final = wrap_atoms_by_id(far_id_list, initial_ini, final_ini)
-        print ('\nAfter wrap!')
-        far_id_list = check_move_far(initial, final)
+
+    options = {'n_image': args.number_of_images, 'method': args.interpolation_method, 'wrap': args.wrap_tag,
+               'match': args.match, 'engine': args.idpp_engine, 'cutoff': args.idpp_cutoff, 'fmax': args.fmax,
+               'steps': args.steps, 'movie_format': args.movie_format, 'trajectory': args.trajectory,
+               'poscar_xyz': args.poscar_xyz}
+    if args.profile:
+        from stage_profile import StageProfile
+        profile = StageProfile(args.profile, args.cprofile)
     else:
-        initial = initial_ini
-        final = final_ini
- 
-    if interpolation_method == 'line':
-        linear_interpolation()
-    elif interpolation_method == 'idpp':
-        idpp_interpolation()
-        
-    print (f'Generate {n_image} images between {args.initial_state_carfile} & {args.final_state_carfile} by {interpolation_method} interpolation!')
+        profile = lambda name: contextlib.nullcontext()
+    if args.resample:
+        with profile('resample'):
+            resample(args.resample, args.number_of_images, args.output_dir, args.density, args.density_width,
+                     args.resample_kind, args.movie_format, args.trajectory, args.poscar_xyz, args.jobs, profile)
+    elif args.batch:
+        with profile('read_manifest'):
+            reactions = read_manifest(args.batch)
+        #the reactions run in worker processes, their CPU time counts once they have ended
+        with profile('batch'):
+            rows = generate_batch(reactions, options, args.jobs)
+        print_summary(rows)
+    else:
+        with profile('generate_neb'):
+            generate_neb(args.initial_state_carfile, args.final_state_carfile, jobs=args.jobs, stage=profile, **options)
+    if args.profile:
+        profile.write()
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+@Description :   --profile of the scripts: wall & CPU time, bytes read/written and peak memory of
+                 the named stages of a run, written to a JSON report.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    #Windows
+    resource = None
+
+
+def io_bytes():
+    #rchar/wchar: every read/write call, pipes included; (None, None) off Linux
+    try:
+        with open('/proc/self/io') as file:
+            fields = dict(line.split(':', 1) for line in file)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def status_kb(key):
+    #VmRSS / VmHWM of this process in kB, None off Linux
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    #VmHWM starts again from the current RSS (Linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def max_rss_mb(who='self'):
+    #the largest RSS of the whole run so far (ru_maxrss: kB on Linux, bytes on macOS), None on Windows
+    if resource is None:
+        return None
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss / scale
+
+
+class StageProfile(object):
+    """``with profile('name'):`` records one stage; ``write()`` dumps the JSON report and prints a table.
+
+    The peak memory of a stage is the largest RSS of this process within
+    it (VmHWM reset at the start of the stage), and its growth over the RSS
+    at the start. Stages may be nested; a sub-stage does not lose the peak
+    of the stage around it. Without the reset (not Linux) it falls back to
+    the largest RSS of the run so far. CPU time includes worker processes
+    that ended within the stage; their own peak is reported when it grew
+    within the stage. The stage named by ``cprofile`` also runs under
+    cProfile, dumped to profile_<stage>.prof.
+    """
+    def __init__(self, file_name, cprofile=None):
+        self.file_name = file_name
+        self.cprofile = cprofile
+        self.stages = []
+        self._open = []
+        self._profile = None
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        if name == self.cprofile:
+            import cProfile
+            self._profile = self._profile or cProfile.Profile()
+            self._profile.enable()
+        record = {'stage': name, 'depth': len(self._open)}
+        self.stages.append(record)
+        #the peak of the enclosing stages so far is kept before VmHWM is reset
+        hwm = status_kb('VmHWM') or 0
+        for i in self._open:
+            i['_peak_kb'] = max(i['_peak_kb'], hwm)
+        reset = reset_peak_rss()
+        base = status_kb('VmRSS')
+        record['_peak_kb'] = base or 0
+        self._open.append(record)
+        workers = max_rss_mb('children')
+        (read, write), times, wall = io_bytes(), os.times(), time.perf_counter()
+        try:
+            yield
+        finally:
+            wall, end, (read_end, write_end) = time.perf_counter() - wall, os.times(), io_bytes()
+            if name == self.cprofile:
+                self._profile.disable()
+            self._open.pop()
+            peak_kb = max(record.pop('_peak_kb'), status_kb('VmHWM') or 0)
+            for i in self._open:
+                i['_peak_kb'] = max(i['_peak_kb'], peak_kb)
+            workers_end = max_rss_mb('children')
+            record.update({'wall_s': wall, 'cpu_s': sum(end[:4]) - sum(times[:4]),
+                           'read_bytes': read_end - read if read is not None else None,
+                           'write_bytes': write_end - write if write is not None else None,
+                           'peak_rss_mb': peak_kb / 2**10 if reset and base is not None else max_rss_mb(),
+                           'peak_rss_delta_mb': (peak_kb - base) / 2**10 if reset and base is not None else None,
+                           'workers_peak_rss_mb': workers_end if workers_end != workers else None})
+
+    def write(self):
+        report = {'argv': sys.argv, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'total_wall_s': time.perf_counter() - self._start, 'stages': self.stages}
+        if self._profile is not None:
+            report['cprofile'] = f'profile_{self.cprofile}.prof'
+            self._profile.dump_stats(report['cprofile'])
+        with open(self.file_name, 'w') as file:
+            json.dump(report, file, indent=1)
+        print(f'{"stage":<20}{"wall (s)":>10}{"cpu (s)":>10}{"read (MB)":>11}{"write (MB)":>11}{"peak (MB)":>11}{"+peak (MB)":>11}')
+        for i in self.stages:
+            print(f'{"  " * i["depth"] + i["stage"]:<20}{i["wall_s"]:>10.3f}{i["cpu_s"]:>10.3f}'
+                  + ''.join(f'{i[key] / 2**20 if i[key] is not None else float("nan"):>11.2f}' for key in ('read_bytes', 'write_bytes'))
+                  + ''.join(f'{i[key] if i[key] is not None else float("nan"):>11.1f}' for key in ('peak_rss_mb', 'peak_rss_delta_mb')))
+        print(f'Profile written to {self.file_name}' + (f', cProfile of {self.cprofile} to {report["cprofile"]}' if 'cprofile' in report else '') + '!')
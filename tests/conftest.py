@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks'), os.path.join(ROOT, 'DrawPED_Origin')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from benchmark import make_poscar, make_outcar, make_vasprun, make_ped_csv, make_neb_endpoints
+
+
+def cut_after_first_forces(file_name):
+    #a running job: the first ionic step has its force block but no energy(sigma->0) / LOOP+ yet
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    force = data.find(b'TOTAL-FORCE (eV/Angst)')
+    end = data.find(b'total drift', force)
+    with open(file_name, 'wb') as file:
+        file.write(data[:end])
+
+
+@pytest.fixture
+def running_job(tmp_path):
+    make_poscar(str(tmp_path / 'POSCAR'), 8)
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 3, 2)
+    cut_after_first_forces(str(tmp_path / 'OUTCAR'))
+    return tmp_path
+
+
+def cut_in_electronic_steps(file_name, n_done):
+    #a killed job: n_done complete ionic steps, then some electronic steps of the next one
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    pos = 0
+    for i in range(n_done):
+        pos = data.find(b'LOOP+:', pos) + 1
+    pos = data.find(b'energy(sigma->0)', pos)
+    with open(file_name, 'wb') as file:
+        file.write(data[:data.find(b'\n', pos) + 1])
@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import DrawPED
+from conftest import ROOT, make_outcar, make_ped_csv
+
+
+def test_numeric_calc_is_rejected(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 2, 2)
+    with open(tmp_path / 'map.json', 'w') as file:
+        json.dump({'pathways': [{'legend': 'a', 'steps': [{'tag': 'IS', 'calc': '.'}, {'tag': 'FS', 'calc': 1}]}]}, file)
+    with pytest.raises(ValueError, match='quote directory names'):
+        DrawPED.build_pathways(str(tmp_path / 'map.json'), cache_file=None)
+
+
+def old_cubic_fit(rcoord, energy, nbins):
+    #the cubic with zero slope at both ends as DrawPED solved it before hermite_curves
+    x0, y0 = rcoord[0], energy[0]
+    x1, y1 = rcoord[1], energy[1]
+    A = np.array([[x0**3, x0**2, x0, 1], [x1**3, x1**2, x1, 1], [3*x0**2, 2*x0, 1, 0], [3*x1**2, 2*x1, 1, 0]])
+    coeff = np.linalg.solve(A, np.array([y0, y1, 0, 0]))
+    xfit = np.linspace(x0, x1, nbins)
+    return xfit, np.polyval(coeff, xfit)
+
+
+def test_hermite_curves_match_cubic_fit():
+    rng = np.random.default_rng(0)
+    x0 = DrawPED.spacing_between_bar * np.arange(12.0)
+    x1 = x0 + DrawPED.spacing_between_bar
+    y0, y1 = rng.normal(0, 1, 12), rng.normal(0, 1, 12)
+    counts = rng.integers(3, DrawPED.nbins + 1, 12)
+    counts[[0, 5]] = [2, DrawPED.nbins]
+    curves = np.split(DrawPED.PEDGenerator.hermite_curves(x0, x1, y0, y1, counts), np.cumsum(counts)[:-1])
+    for k, curve in enumerate(curves):
+        xfit, yfit = old_cubic_fit([x0[k], x1[k]], [y0[k], y1[k]], counts[k])
+        np.testing.assert_allclose(curve[:, 0], xfit, rtol=0, atol=1e-11)
+        np.testing.assert_allclose(curve[:, 1], yfit, rtol=0, atol=1e-11)
+        assert tuple(curve[0]) == (x0[k], y0[k]) and tuple(curve[-1]) == (x1[k], y1[k])
+    xfit, yfit = DrawPED.PEDGenerator.cubic_fit([x0[3], x1[3]], [y0[3], y1[3]])
+    np.testing.assert_allclose(yfit, old_cubic_fit([x0[3], x1[3]], [y0[3], y1[3]], DrawPED.nbins)[1], rtol=0, atol=1e-11)
+
+
+def test_pathway_table_round_trip(tmp_path):
+    #pathways of different length, trailing empty cells from a spreadsheet and blank rows
+    with open(tmp_path / 'ped.csv', 'w') as file:
+        file.write('k,0,0.8,-0.4,0.1,,\npath1,S,TS1,IM1,P,,\n\nr,0,1.2,-0.3,,,\npath2, S ,TS1,P,,,\n')
+    table = DrawPED.PathwayTable.read_csv(str(tmp_path / 'ped.csv'))
+    expected = DrawPED.PathwayTable.from_lists([[0, 0.8, -0.4, 0.1], [0, 1.2, -0.3]], [['S', 'TS1', 'IM1', 'P'], ['S', 'TS1', 'P']],
+                                               ['path1', 'path2'], ['k', 'r'])
+    for key in ('energies', 'tag_ids', 'offsets'):
+        np.testing.assert_array_equal(getattr(table, key), getattr(expected, key))
+    assert table.tag_names == expected.tag_names == ['S', 'TS1', 'IM1', 'P']
+    assert (table.legend, table.color, list(table.n_point)) == (['path1', 'path2'], ['k', 'r'], [4, 3])
+    assert len(table) == 2 and [len(i) for i in table] == [4, 3] and len(table[:1]) == 1
+    assert table[-1].tags == ['S', 'TS1', 'P'] and repr(table[1]) == "[0.0:'S', 1.2:'TS1', -0.3:'P']"
+    with pytest.raises(IndexError):
+        table[2]
+    #a view and a standalone pathway give the same points and curves
+    pair = DrawPED.EnergyTagPair([0, 1.2, -0.3], ['S', 'TS1', 'P'])
+    assert (pair[1].energy, pair[1].tag) == (table[1][1].energy, table[1][1].tag) == (1.2, 'TS1')
+    assert [i.tag for i in pair] == [i.tag for i in table[1]] and [i.tag for i in pair[1:]] == ['TS1', 'P']
+    ped = DrawPED.PEDGenerator(table)
+    for (line, scatter), (line_pair, scatter_pair) in zip(ped.gen_all_line_scatter_data()[1:], ped.gen_all_line_scatter_data([pair])):
+        np.testing.assert_array_equal(line, line_pair)
+        np.testing.assert_array_equal(scatter, scatter_pair)
+    with pytest.raises(ValueError):
+        DrawPED.EnergyTagPair([0, 1], ['S'])
+
+
+@pytest.mark.parametrize('content, message', [('k,0,1\npath1,S\n', 'row 2'), ('k,0,1\npath1,S,P\nr,0,1\n', 'pathway 2')])
+def test_pathway_table_rejects_broken_csv(tmp_path, content, message):
+    with open(tmp_path / 'ped.csv', 'w') as file:
+        file.write(content)
+    with pytest.raises(ValueError, match=message):
+        DrawPED.PathwayTable.read_csv(str(tmp_path / 'ped.csv'))
+
+
+def test_cli_profile_stages(tmp_path):
+    make_ped_csv(str(tmp_path / 'ped.csv'), 5)
+    command = [sys.executable, os.path.join(ROOT, 'DrawPED_Origin', 'DrawPED.py'), '-i', 'ped.csv', '-p', 'none', '--profile', 'p.json']
+    result = subprocess.run(command, cwd=tmp_path, capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': ROOT})
+    assert result.returncode == 0, result.stderr
+    with open(tmp_path / 'p.json') as file:
+        assert [i['stage'] for i in json.load(file)['stages']] == ['load', 'curves', 'save_data']
+    #without the repository root on PYTHONPATH the message says so
+    result = subprocess.run(command, cwd=tmp_path, capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': ''})
+    assert result.returncode and 'must be on PYTHONPATH' in result.stderr
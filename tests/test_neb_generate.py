@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import neb_generate as ng
+from conftest import ROOT, make_neb_endpoints
+
+
+@pytest.fixture
+def endpoints(tmp_path):
+    from ase.io import write
+    initial, final = make_neb_endpoints(16)
+    for name, atoms in (('is', initial), ('fs', final)):
+        os.makedirs(tmp_path / name)
+        write(str(tmp_path / name / 'CONTCAR'), atoms, format='vasp')
+    return tmp_path
+
+
+def test_batch_reports_invalid_entries(endpoints):
+    with open(endpoints / 'manifest.csv', 'w') as file:
+        file.write('name,initial,final,n_image,method\n'
+                   'good,is/CONTCAR,fs/CONTCAR,3,line\n'
+                   'no_final,is/CONTCAR,,3,line\n'
+                   'bad_n,is/CONTCAR,fs/CONTCAR,three,line\n'
+                   '\n')
+    reactions = ng.read_manifest(str(endpoints / 'manifest.csv'))
+    assert [i['name'] for i in reactions] == ['good', 'no_final', 'bad_n']
+    rows = ng.generate_batch(reactions, {'n_image': 5, 'method': 'idpp'}, 1)
+    errors = {i['name']: i['error'] for i in rows}
+    assert errors['good'] == '' and 'no final' in errors['no_final'] and 'three' in errors['bad_n']
+    assert os.path.isfile(endpoints / '04' / 'POSCAR')
+    ng.print_summary(rows)
+
+
+def test_yaml_entry_without_initial(endpoints):
+    pytest.importorskip('yaml')
+    with open(endpoints / 'manifest.yaml', 'w') as file:
+        file.write('- {name: a, initial: is/CONTCAR, final: fs/CONTCAR}\n- {name: b, final: fs/CONTCAR}\n- just a string\n')
+    reactions = ng.read_manifest(str(endpoints / 'manifest.yaml'))
+    assert 'error' not in reactions[0] and 'no initial' in reactions[1]['error'] and 'mapping' in reactions[2]['error']
+
+
+@pytest.mark.parametrize('kind', ['linear', 'cubic'])
+def test_resample_identical_adjacent_images(endpoints, kind):
+    pytest.importorskip('scipy')
+    from ase.io import read
+    initial, final = read(str(endpoints / 'is' / 'CONTCAR')), read(str(endpoints / 'fs' / 'CONTCAR'))
+    band = ng.linear_interpolation(initial, final, 3)
+    #a restarted image that did not move: two identical neighbours, and a copy of the end image
+    band = band[:2] + [band[1].copy()] + band[2:] + [band[-1].copy()]
+    energies = np.full(len(band), np.nan)
+    new_band, length, i_max = ng.resample_band(band, energies, 5, kind=kind)
+    positions = np.array([i.get_positions() for i in new_band])
+    assert len(new_band) == 7 and np.isfinite(positions).all()
+    steps = np.linalg.norm((positions[1:] - positions[:-1]).reshape(6, -1), axis=1)
+    np.testing.assert_allclose(steps, steps.mean(), rtol=1e-6)
+
+
+def test_idpp_every_pair_follows_minimum_image():
+    #-c 0 must give the band of ase idpp(mic=True), also for pairs that change their nearest image on the way
+    from ase import Atoms
+    from ase.constraints import FixAtoms
+    from ase.mep.neb import idpp_interpolate
+    rng = np.random.default_rng(1)
+    cell = [[6.0, 0, 0], [1.0, 6.5, 0], [0.5, 0.3, 7.0]]
+    initial = Atoms('Cu8O2', scaled_positions=rng.random((10, 3)), cell=cell, pbc=True)
+    final = initial.copy()
+    positions = final.get_positions()
+    positions[8:] += [[1.6, 0.9, 0.4], [-1.0, 1.2, -0.8]]
+    positions[2:8] += rng.normal(0, 0.15, (6, 3))
+    final.set_positions(positions)
+    for atoms in (initial, final):
+        atoms.set_constraint(FixAtoms(indices=[0, 1]))
+    band = ng.linear_interpolation(initial, final, 3)
+    reference = [i.copy() for i in band]
+    assert ng.idpp_native(band, 0, fmax=0.01, steps=500) < 500
+    idpp_interpolate(ng.get_neb_class()(reference, method='improvedtangent'), traj=None, log=None, mic=True, fmax=0.01, steps=500)
+    for image, expected in zip(band, reference):
+        np.testing.assert_allclose(image.get_positions(), expected.get_positions(), atol=1e-6)
+
+
+def test_wrap_far_atoms_in_triclinic_cell():
+    #fs written back into a skewed cell: rounding the fractional displacement alone picks the wrong image
+    from ase import Atoms
+    from ase.geometry import find_mic
+    rng = np.random.default_rng(0)
+    cell = np.array([[5.0, 0, 0], [4.0, 3.0, 0], [0, 0, 10.0]])
+    initial = Atoms('Pt20', scaled_positions=rng.random((20, 3)), cell=cell, pbc=True)
+    step = find_mic(rng.normal(0, 1.0, (20, 3)), cell)[0]
+    final = initial.copy()
+    final.set_positions(initial.get_positions() + step)
+    final.wrap()
+    shift = ng.check_move_far(initial, final)
+    assert shift.any(axis=1).sum() > 5
+    naive = np.rint(initial.get_scaled_positions() - final.get_scaled_positions())
+    assert (naive != shift).any(axis=1).sum() == 2
+    initial_wrap, final_wrap = ng.wrap_atoms_by_id(shift, initial, final)
+    np.testing.assert_allclose(final_wrap.get_positions() - initial_wrap.get_positions(), step, atol=1e-10)
+    assert not ng.check_move_far(initial_wrap, final_wrap).any()
+
+
+@pytest.mark.parametrize('k', [1, 8])
+def test_match_atoms_recovers_permutation(k):
+    #a relaxed, partly wrapped and shuffled fs of a slab is put back in the order of is
+    initial, final = make_neb_endpoints(36)
+    rng = np.random.default_rng(0)
+    final.set_constraint()
+    final.positions[:-1] += rng.normal(0, 0.1, (len(final) - 1, 3))
+    final.wrap()
+    order = rng.permutation(len(final))
+    perm = ng.match_atoms(initial, final[order], k)
+    np.testing.assert_array_equal(order[perm], np.arange(len(final)))
+    assert (ng.match_atoms(initial, final) == np.arange(len(final))).all()
+
+
+def test_cli_profile_sub_stages(endpoints):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'neb_generate.py'), '-i', 'is/CONTCAR', '-f', 'fs/CONTCAR',
+                             '-n', '3', '--match', '--profile', 'p.json'], cwd=endpoints, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    with open(endpoints / 'p.json') as file:
+        stages = [(i['stage'], i['depth']) for i in json.load(file)['stages']]
+    assert stages == [('generate_neb', 0), ('read_structures', 1), ('match', 1), ('check_far', 1), ('idpp', 1), ('write_images', 1)]
@@ -0,0 +1,28 @@
+import json
+
+import numpy as np
+import pytest
+
+import stage_profile
+
+
+@pytest.mark.skipif(not stage_profile.reset_peak_rss(), reason='VmHWM cannot be reset here')
+def test_peak_memory_per_stage(tmp_path, capsys):
+    profile = stage_profile.StageProfile(str(tmp_path / 'p.json'))
+    with profile('outer'):
+        with profile('heavy'):
+            data = np.ones(2**25)
+            del data
+        with profile('light'):
+            data = np.ones(2**10)
+    profile.write()
+    with open(tmp_path / 'p.json') as file:
+        outer, heavy, light = json.load(file)['stages']
+    assert [i['stage'] for i in (outer, heavy, light)] == ['outer', 'heavy', 'light']
+    assert (outer['depth'], heavy['depth'], light['depth']) == (0, 1, 1)
+    #256 MB in the heavy stage only, the light one after it does not inherit its peak
+    assert heavy['peak_rss_delta_mb'] > 200 and light['peak_rss_delta_mb'] < 20
+    assert light['peak_rss_mb'] < heavy['peak_rss_mb'] - 200
+    #the stage around both keeps the peak of the heavy one
+    assert outer['peak_rss_mb'] >= heavy['peak_rss_mb'] and outer['peak_rss_delta_mb'] > 200
+    assert '  heavy' in capsys.readouterr().out
@@ -0,0 +1,316 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import vasp_plot_conv as vpc
+from conftest import ROOT, make_poscar, make_outcar, make_vasprun, cut_in_electronic_steps
+
+
+def test_pending_step_without_energy(running_job):
+    outcar_data = vpc.parse_outcar(str(running_job / 'OUTCAR'), cache=False)
+    assert 'energy' not in outcar_data and len(outcar_data['forces']) == 1
+    atominfo_list, selective_list, selective_list_array = vpc.read_poscar(str(running_job / 'POSCAR'))
+    conv = vpc.check_conv(outcar_data, selective_list_array)
+    assert np.isnan(conv['energy_array']).all()
+    vpc.show_conv(conv, atominfo_list)
+
+
+def test_cli_on_running_job(running_job):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'vasp_plot_conv.py'), '--no_cache'],
+                            cwd=running_job, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'After 1 ionic steps' in result.stdout
+
+
+def test_batch_isolates_failing_jobs(tmp_path, running_job, monkeypatch):
+    for name in ('good', 'broken', 'crash'):
+        os.makedirs(tmp_path / 'tree' / name)
+        make_poscar(str(tmp_path / 'tree' / name / 'POSCAR'), 8)
+        make_outcar(str(tmp_path / 'tree' / name / 'OUTCAR'), 8, 3, 2)
+    with open(tmp_path / 'tree' / 'broken' / 'POSCAR', 'w') as file:
+        file.write('not a POSCAR\n')
+    os.rename(running_job / 'OUTCAR', tmp_path / 'tree' / 'crash' / 'OUTCAR')
+    read_last_step = vpc.read_last_step
+    def crash(file_name, *args):
+        if os.sep + 'crash' + os.sep in file_name:
+            raise KeyError('energy')
+        return read_last_step(file_name, *args)
+    monkeypatch.setattr(vpc, 'read_last_step', crash)
+
+    rows = vpc.survey_jobs(vpc.find_jobs([str(tmp_path / 'tree')]), n_worker=1)
+    errors = {os.path.basename(i['path']): i['error'] for i in rows}
+    assert errors['good'] == '' and errors['broken'] and errors['crash'].startswith('KeyError')
+    vpc.write_summary(rows, str(tmp_path / 'summary.csv'))
+    assert len(open(tmp_path / 'summary.csv').readlines()) == 4
+
+
+def test_batch_cli_with_running_job(tmp_path, running_job):
+    os.makedirs(tmp_path / 'tree' / 'done')
+    make_poscar(str(tmp_path / 'tree' / 'done' / 'POSCAR'), 8)
+    make_outcar(str(tmp_path / 'tree' / 'done' / 'OUTCAR'), 8, 3, 2)
+    os.makedirs(tmp_path / 'tree' / 'running')
+    for name in ('POSCAR', 'OUTCAR'):
+        os.rename(running_job / name, tmp_path / 'tree' / 'running' / name)
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'vasp_plot_conv.py'), '-b', 'tree', '-j', '2'],
+                            cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert '2 jobs surveyed' in result.stdout and os.path.isfile(tmp_path / 'conv_summary.csv')
+
+
+def test_float32_holds_half_the_memory(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 128, 200, 2)
+    held = {}
+    for dtype in (np.float64, np.float32):
+        tracemalloc.start()
+        outcar_data = vpc.parse_outcar(str(tmp_path / 'OUTCAR'), 1 << 16, cache=False, dtype=dtype)
+        conv = vpc.check_conv(outcar_data, np.ones((128, 3)), dtype)
+        del outcar_data
+        held[dtype] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        trajectory = conv['trajectory']
+        assert trajectory.forces.dtype == dtype and trajectory.positions.dtype == dtype
+    #positions & forces are read straight into float32, with no float64 copy alive or at the peak
+    current, peak = held[np.float32]
+    assert current < 0.6 * held[np.float64][0] and peak < 0.6 * held[np.float64][1]
+
+
+def test_cache_precision(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 3, 2)
+    full = vpc.parse_outcar(str(tmp_path / 'OUTCAR'))
+    single = vpc.parse_outcar(str(tmp_path / 'OUTCAR'), dtype=np.float32)
+    assert single['forces'].dtype == np.float32 and single['energy'].dtype == np.float64
+    assert vpc.parse_outcar(str(tmp_path / 'OUTCAR'))['forces'].dtype == np.float64
+    np.testing.assert_allclose(single['forces'], full['forces'], atol=1e-6)
+
+
+def test_choose_source(tmp_path):
+    #a finished job: OUTCAR parses several times faster per byte
+    make_outcar(str(tmp_path / 'OUTCAR'), 300, 30, 10)
+    make_vasprun(str(tmp_path / 'vasprun.xml'), 300, 30, 10)
+    assert vpc.choose_source(str(tmp_path)) == ('outcar', str(tmp_path / 'OUTCAR'))
+    #a verbose OUTCAR (many electronic steps) against a lean vasprun.xml
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 3, 400)
+    make_vasprun(str(tmp_path / 'vasprun.xml'), 8, 3, 1)
+    assert vpc.choose_source(str(tmp_path)) == ('vasprun', str(tmp_path / 'vasprun.xml'))
+    #gzip: the uncompressed size counts, not the size on disk
+    outcar = compress(str(tmp_path / 'OUTCAR'), 'gz')
+    os.remove(tmp_path / 'OUTCAR')
+    assert os.path.getsize(outcar) / vpc.OUTCAR_RATE < os.path.getsize(tmp_path / 'vasprun.xml') / vpc.VASPRUN_RATE
+    assert vpc.choose_source(str(tmp_path)) == ('vasprun', str(tmp_path / 'vasprun.xml'))
+    #an up-to-date cache makes OUTCAR free to read
+    vpc.parse_outcar(outcar)
+    assert vpc.choose_source(str(tmp_path))[0] == 'outcar'
+    assert vpc.choose_source(str(tmp_path), dtype=np.float32)[0] == 'vasprun'
+    assert vpc.choose_source(str(tmp_path), cache=False)[0] == 'vasprun'
+    #a vasprun.xml cut off by the running job is never read
+    os.remove(f'{outcar}.conv_cache.npz')
+    with open(tmp_path / 'vasprun.xml', 'r+') as file:
+        file.truncate(os.path.getsize(tmp_path / 'vasprun.xml') - 200)
+    assert vpc.choose_source(str(tmp_path))[0] == 'outcar'
+
+
+def test_cli_profile(running_job):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'vasp_plot_conv.py'), '--no_cache', '--profile', 'p.json'],
+                            cwd=running_job, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    with open(running_job / 'p.json') as file:
+        stages = [i['stage'] for i in json.load(file)['stages']]
+    assert stages == ['choose_source', 'read_poscar', 'parse_outcar', 'check_conv', 'plot', 'write_log']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096, vpc.CHUNK_SIZE])
+def test_chunk_boundaries(tmp_path, chunk_size):
+    #tokens and blocks split across chunks give the same steps as one read
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 4, 2)
+    with open(tmp_path / 'OUTCAR', 'rb') as file:
+        data = file.read()
+    whole = vpc.OutcarParser()
+    expected = vpc.stack_steps(whole.feed(data) + whole.close())
+    parser = vpc.OutcarParser()
+    steps = []
+    for i in range(0, len(data), chunk_size):
+        steps.extend(parser.feed(data[i:i+chunk_size]))
+    result = vpc.stack_steps(steps + parser.close())
+    assert len(result['forces']) == 4 and parser.ediffg == whole.ediffg == -0.02
+    np.testing.assert_allclose(result['energy'], -123 - 1e-3*np.arange(4))
+    for key in ('energy', 'positions', 'forces', 'stress', 'magnetization', 'real_time'):
+        np.testing.assert_array_equal(result[key], expected[key])
+
+
+def assert_same_data(result, expected):
+    assert result.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_array_equal(result[key], expected[key])
+
+
+def cached_and_cold(file_name):
+    #the cached result must equal a parse that ignores the cache
+    return vpc.parse_outcar(file_name), vpc.parse_outcar(file_name, cache=False)
+
+
+def test_cache_resumes_after_append(tmp_path, monkeypatch):
+    make_outcar(str(tmp_path / 'full'), 8, 5, 2)
+    with open(tmp_path / 'full', 'rb') as file:
+        data = file.read()
+    #two closed steps and half of the third
+    cut = data.find(b'TOTAL-FORCE', data.find(b'LOOP+:', data.find(b'LOOP+:') + 1))
+    with open(tmp_path / 'OUTCAR', 'wb') as file:
+        file.write(data[:cut])
+    cached, cold = cached_and_cold(str(tmp_path / 'OUTCAR'))
+    assert len(cached['forces']) == 2
+    with open(tmp_path / 'OUTCAR', 'ab') as file:
+        file.write(data[cut:])
+    offsets = []
+    load_cache = vpc.load_cache
+    def spy(*args, **kwargs):
+        result = load_cache(*args, **kwargs)
+        offsets.append(result[1].offset if result else None)
+        return result
+    monkeypatch.setattr(vpc, 'load_cache', spy)
+    cached, cold = cached_and_cold(str(tmp_path / 'OUTCAR'))
+    assert offsets[0] and offsets[0] < cut
+    assert len(cached['forces']) == 5
+    assert_same_data(cached, cold)
+
+
+def test_cache_rejected_after_truncate(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 5, 2)
+    vpc.parse_outcar(str(tmp_path / 'OUTCAR'))
+    with open(tmp_path / 'OUTCAR', 'rb+') as file:
+        data = file.read()
+        file.truncate(data.find(b'TOTAL-FORCE', data.find(b'LOOP+:')))
+    cached, cold = cached_and_cold(str(tmp_path / 'OUTCAR'))
+    assert len(cached['forces']) == 1
+    assert_same_data(cached, cold)
+
+
+def test_cache_rejected_after_rewrite(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 5, 2)
+    vpc.parse_outcar(str(tmp_path / 'OUTCAR'))
+    size = os.path.getsize(tmp_path / 'OUTCAR')
+    #a job restarted into the same file, same size but other numbers
+    make_outcar(str(tmp_path / 'other'), 8, 5, 2, seed=1)
+    with open(tmp_path / 'other', 'rb') as other, open(tmp_path / 'OUTCAR', 'rb+') as file:
+        file.write(other.read())
+    assert os.path.getsize(tmp_path / 'OUTCAR') == size
+    cached, cold = cached_and_cold(str(tmp_path / 'OUTCAR'))
+    assert_same_data(cached, cold)
+    assert_same_data(cached, vpc.parse_outcar(str(tmp_path / 'other'), cache=False))
+
+
+def test_cache_rejected_for_replaced_file(tmp_path):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 5, 2)
+    vpc.parse_outcar(str(tmp_path / 'OUTCAR'))
+    make_outcar(str(tmp_path / 'other'), 8, 6, 2, seed=2)
+    os.replace(tmp_path / 'other', tmp_path / 'OUTCAR')
+    cached, cold = cached_and_cold(str(tmp_path / 'OUTCAR'))
+    assert len(cached['forces']) == 6
+    assert_same_data(cached, cold)
+
+
+CODECS = {'gz': 'gzip', 'xz': 'xz', 'bz2': 'bzip2'}
+
+
+def use_tool(monkeypatch, codec, tool):
+    #stream through the external decompressor, or force the python module fallback
+    if not tool:
+        monkeypatch.setattr(vpc.shutil, 'which', lambda name: None)
+    elif not any(vpc.shutil.which(command[0]) for key, name, commands, module in vpc.COMPRESSION
+                 if name == CODECS[codec] for command in commands):
+        pytest.skip(f'no {CODECS[codec]} decompressor installed')
+
+
+def compress(file_name, codec):
+    module = {'gz': gzip, 'xz': lzma, 'bz2': bz2}[codec]
+    with open(file_name, 'rb') as file, module.open(f'{file_name}.{codec}', 'wb') as archive:
+        archive.write(file.read())
+    return f'{file_name}.{codec}'
+
+
+@pytest.mark.parametrize('tool', [True, False], ids=['tool', 'module'])
+@pytest.mark.parametrize('codec', ['gz', 'xz', 'bz2'])
+def test_compressed_outcar(tmp_path, monkeypatch, codec, tool):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 4, 2)
+    plain = vpc.parse_outcar(str(tmp_path / 'OUTCAR'), cache=False)
+    archive = compress(str(tmp_path / 'OUTCAR'), codec)
+    use_tool(monkeypatch, codec, tool)
+    assert_same_data(vpc.parse_outcar(archive, cache=False), plain)
+    assert vpc.read_ediffg(archive) == plain['ediffg']
+    assert vpc.read_last_step(archive)[0] == 4
+
+
+@pytest.mark.parametrize('tool', [True, False], ids=['tool', 'module'])
+def test_truncated_gz(tmp_path, monkeypatch, capfd, tool):
+    make_outcar(str(tmp_path / 'OUTCAR'), 8, 4, 2)
+    archive = compress(str(tmp_path / 'OUTCAR'), 'gz')
+    with open(archive, 'rb+') as file:
+        file.truncate(os.path.getsize(archive) // 2)
+    use_tool(monkeypatch, 'gz', tool)
+    with pytest.raises(OSError, match='failed to decompress'):
+        vpc.parse_outcar(archive, cache=False)
+    out, err = capfd.readouterr()
+    assert err == ''
+
+
+def test_band_survives_damaged_image(tmp_path, monkeypatch, capsys):
+    for i in range(5):
+        os.makedirs(tmp_path / f'{i:02d}')
+        make_outcar(str(tmp_path / f'{i:02d}' / 'OUTCAR'), 8, 3, 2, seed=i)
+    parse_outcar = vpc.parse_outcar
+    def damaged(file_name, *args, **kwargs):
+        if f'{os.sep}02{os.sep}' in file_name:
+            raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+        return parse_outcar(file_name, *args, **kwargs)
+    monkeypatch.setattr(vpc, 'parse_outcar', damaged)
+    band = vpc.survey_band(str(tmp_path), n_worker=1, cache=False)
+    assert band['rows'][1]['error'].startswith('EOFError') and not band['rows'][0]['error']
+    assert band['profiles'].shape == (3, 5) and np.isnan(band['profiles'][:, 2]).all()
+    assert np.isfinite(band['profiles'][:, [0, 1, 3, 4]]).all()
+    vpc.show_band(band)
+    assert '1 images could not be read!' in capsys.readouterr().out
+
+
+def cut_in_forces(file_name, n_done):
+    #a running job: n_done complete ionic steps, the force block of the next one written but no energy yet
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    pos = 0
+    for i in range(n_done + 1):
+        pos = data.find(b'total drift', pos) + 1
+    with open(file_name, 'wb') as file:
+        file.write(data[:pos - 1])
+
+
+@pytest.mark.parametrize('window', [256, 1 << 20])
+def test_read_final_energy(tmp_path, window):
+    file_name = str(tmp_path / 'OUTCAR')
+    make_outcar(file_name, 8, 4, 3)
+    energy = vpc.parse_outcar(file_name, cache=False)['energy']
+    assert vpc.read_final_energy(file_name, window) == energy[-1]
+    #unfinished: killed in the electronic steps after the second ionic step
+    cut_in_electronic_steps(file_name, 2)
+    assert vpc.read_final_energy(file_name, window) == energy[1]
+    assert vpc.read_last_step(file_name, window, 'energy')[0] == 2
+    assert vpc.read_final_energy(compress(file_name, 'gz'), window) == energy[1]
+    #truncated: the forces of the third step are there, its energy is not
+    make_outcar(file_name, 8, 4, 3)
+    cut_in_forces(file_name, 2)
+    n_step, step = vpc.read_last_step(file_name, window)
+    assert n_step == 3 and 'energy' not in step
+    assert vpc.read_final_energy(file_name, window) == energy[1]
+    assert vpc.read_last_step(file_name, window, 'energy')[0] == 2
+    os.remove(f'{file_name}.gz')
+    assert vpc.read_final_energy(compress(file_name, 'gz'), window) == energy[1]
+    #nothing complete yet
+    cut_in_forces(file_name, 0)
+    assert np.isnan(vpc.read_final_energy(file_name, window))
+    cut_in_electronic_steps(file_name, 0)
+    assert np.isnan(vpc.read_final_energy(file_name, window)) and vpc.read_last_step(file_name, window) == (0, None)
@@ -4,13 +4,32 @@
 __author__ = 'wankw (wankaiweii@gmail.com)' 
 
 import re
+import os
+import json
+import time
+import select
+import hashlib
+import csv
+import bz2
+import gzip
+import lzma
+import shutil
+import subprocess
+import tempfile
+import zlib
+import contextlib
+import xml.etree.ElementTree as ET
 import numpy as np
-from plotille import *
-from matplotlib import pyplot as plt
-import matplotlib.ticker as ticker
 import argparse
+#plotille and matplotlib are imported by term_plot / mp_plot, only the chosen backend is loaded
+
+#OUTCAR is read in chunks of this size, never as a whole
+CHUNK_SIZE = 1 << 24
+#bump when the parsed quantities change, older sidecar caches are then ignored
+CACHE_VERSION = 2
 
 ## plot convergence log in terminate
+#y_data may also be a list of series on the same x, the last one is highlighted
 def term_plot(x_data,y_data,x_label,y_label):
     #formate: float -> int
     def _num_formatter(val, chars, delta, left=True):
@@ -18,161 +37,1162 @@ def term_plot(x_data,y_data,x_label,y_label):
         return '{:{}{}d}'.format(int(val), align, chars)
     #fig.register_label_formatter(float, _num_formatter)
     #fig.register_label_formatter(int, _num_formatter)
+    from plotille import Figure
     
     fig = Figure()
     fig.width = 50
     fig.height = 25
-    fig.set_x_limits(min(x_data), max(x_data))
-    fig.set_y_limits(min(y_data), max(y_data))
+    y_list = y_data if np.ndim(y_data) == 2 else [y_data]
+    x_min, x_max = min(x_data), max(x_data)
+    y_min, y_max = np.nanmin(y_list), np.nanmax(y_list)
+    #a single step has no range, plotille needs min < max
+    if x_min == x_max:
+        x_max = x_min + 1
+    if y_min == y_max:
+        y_max = y_min + max(abs(y_min)*1e-3, 1e-6)
+    fig.set_x_limits(x_min, x_max)
+    fig.set_y_limits(y_min, y_max)
     fig.x_label = x_label
     fig.y_label = y_label
     fig.color_mode = 'byte'
-    #lc: line color
-    fig.plot(x_data,y_data,lc=155)
+    #lc: line color, earlier series in gray
+    for i, y in enumerate(y_list):
+        fig.plot(x_data,y,lc=155 if i == len(y_list)-1 else 245)
     print(fig.show())
 
 
 def mp_plot(x_data,y_data,x_label,y_label):        
+    from matplotlib import pyplot as plt
+    import matplotlib.ticker as ticker
+    plt.clf()
     plt.xlabel(x_label) 
     plt.ylabel(y_label)
-    plt.plot(x_data,y_data,'k--o',mfc='r')
+    y_list = y_data if np.ndim(y_data) == 2 else [y_data]
+    for i, y in enumerate(y_list[:-1]):
+        plt.plot(x_data,y,'--o',color='0.6',mfc='0.8',alpha=0.3+0.7*(i+1)/len(y_list))
+    plt.plot(x_data,y_list[-1],'k--o',mfc='r')
     plt.gca().yaxis.set_major_formatter(ticker.FormatStrFormatter('%.5f'))
     plt.tight_layout()
     plt.savefig(f'conv-{y_label.split()[0]}.png',dpi=300)
 
 
+## streaming OUTCAR parser
+class OutcarParser(object):
+    """Incremental single-pass tokenizer over the raw bytes of an OUTCAR.
+
+    Data may be fed in chunks of any size; only complete lines are scanned and
+    a TOTAL-FORCE block cut by the chunk border is carried over to the next
+    feed, so memory is bounded by one chunk plus one ionic step.
+
+    Every quantity is a (token, handler) pair in ``tokens``: all tokens are
+    located in each chunk and dispatched in file order, so a new quantity
+    costs one more handler, not another scan of the file. Handlers store
+    their values in the current step, which is closed by the LOOP+ line.
+
+    ``step_offset`` is the absolute byte offset just after the last closed
+    step; a new parser created with that offset resumes the file from there.
+    """
+    tokens = ((b'EDIFFG =', '_read_ediffg'),
+              (b'number of electron', '_read_magnetization'),
+              (b'in kB', '_read_stress'),
+              (b'TOTAL-FORCE (eV/Angst)', '_read_forces'),
+              (b'energy(sigma->0) =', '_read_energy'),
+              (b'FORCES: max atom, RMS', '_read_neb_force'),
+              (b'LOOP+:', '_read_loop'),
+              (b'General timing and accounting', '_read_finished'))
+
+    def __init__(self, offset=0, ediffg=None, dtype=np.float64):
+        self.ediffg = ediffg
+        #positions & forces are read in this precision, the rest in float64
+        self.dtype = dtype
+        self.finished = False
+        self.offset = offset
+        self.step_offset = offset
+        self._buf = b''
+        self._step = {}
+        self._tokens = [(token, getattr(self, handler)) for token, handler in self.tokens]
+
+    def feed(self, data):
+        buf = self._buf + data
+        end = buf.rfind(b'\n') + 1
+        events = []
+        for token, handler in self._tokens:
+            pos = buf.find(token, 0, end)
+            while pos >= 0:
+                events.append((pos, handler))
+                pos = buf.find(token, pos + 1, end)
+        events.sort(key=lambda i: i[0])
+
+        steps = []
+        used = 0
+        for pos, handler in events:
+            if pos < used:
+                continue
+            stop = handler(buf, pos, end, steps)
+            if stop < 0:
+                #incomplete block, keep it from the start of its line
+                end = buf.rfind(b'\n', 0, pos) + 1
+                break
+            used = stop
+        self._buf = buf[end:]
+        self.offset += end
+        return steps
+
+    def pending(self):
+        #a step without LOOP+ yet (running or killed job) still counts once it has forces
+        return [dict(self._step)] if 'forces' in self._step else []
+
+    def close(self):
+        steps = self.pending()
+        self._step = {}
+        return steps
+
+    def _read_ediffg(self, buf, pos, end, steps):
+        stop = buf.find(b'\n', pos, end)
+        line = buf[pos:stop]
+        if b'stopping-criterion for IOM' in line:
+            self.ediffg = float(line.split()[2])
+        return stop
+
+    def _read_magnetization(self, buf, pos, end, steps):
+        #printed every electronic step, the last one before LOOP+ wins
+        stop = buf.find(b'\n', pos, end)
+        mag = buf[pos:stop].partition(b'magnetization')[2].split()
+        if mag:
+            self._step['magnetization'] = np.linalg.norm(np.array(mag, dtype=float))
+        return stop
+
+    def _read_stress(self, buf, pos, end, steps):
+        stop = buf.find(b'\n', pos, end)
+        #F12.5 fields may run into each other for large stresses
+        stress = float_tag.findall(buf, pos, stop)
+        if len(stress) == 6:
+            self._step['stress'] = np.array(stress, dtype=float)
+        return stop
+
+    def _read_forces(self, buf, pos, end, steps):
+        #header, dashed line, then one line per atom until the next dashed line
+        head = buf.find(b'\n', pos, end)
+        dash = buf.find(b'\n', head + 1, end) if head >= 0 else -1
+        stop = buf.find(b'\n -', dash, end) if dash >= 0 else -1
+        if stop < 0:
+            return -1
+        block = np.array(buf[dash+1:stop].split(), dtype=self.dtype).reshape(-1, 6)
+        self._step['positions'] = block[:, 0:3]
+        self._step['forces'] = block[:, 3:6]
+        return stop
+
+    def _read_energy(self, buf, pos, end, steps):
+        stop = buf.find(b'\n', pos, end)
+        #only the first energy(sigma->0) after the forces belongs to the ionic step
+        if 'forces' in self._step and 'energy' not in self._step:
+            self._step['energy'] = float(buf[pos:stop].split()[2])
+        return stop
+
+    def _read_neb_force(self, buf, pos, end, steps):
+        #VTST NEB image: max atom force after the spring projection, the one EDIFFG is applied to
+        stop = buf.find(b'\n', pos, end)
+        force = float_tag.findall(buf, pos, stop)
+        if force:
+            self._step['neb_force'] = float(force[0])
+        return stop
+
+    def _read_loop(self, buf, pos, end, steps):
+        stop = buf.find(b'\n', pos, end)
+        times = float_tag.findall(buf, pos, stop)
+        if len(times) == 2:
+            self._step['cpu_time'], self._step['real_time'] = map(float, times)
+        if 'forces' in self._step:
+            steps.append(self._step)
+            self._step = {}
+            self.step_offset = self.offset + stop + 1
+        return stop
+
+    def _read_finished(self, buf, pos, end, steps):
+        #VASP writes its timing summary only once the job is done
+        self.finished = True
+        return buf.find(b'\n', pos, end)
+
+
+float_tag = re.compile(rb'-?\d+\.\d+')
+
+
+def stack_steps(steps):
+    #list of step dicts -> one array per quantity, NaN where a step lacks it;
+    #each array keeps the precision its step values were read in
+    data = {}
+    for i, step in enumerate(steps):
+        for key, value in step.items():
+            if key not in data:
+                data[key] = np.full((len(steps),) + np.shape(value), np.nan, dtype=getattr(value, 'dtype', float))
+            data[key][i] = value
+    return data
+
+
+def concat_data(*data_list):
+    #join stacked step arrays, padding quantities missing in a part with NaN
+    data_list = [i for i in data_list if i]
+    if len(data_list) < 2:
+        return dict(data_list[0]) if data_list else {}
+    rows = [len(next(iter(i.values()))) for i in data_list]
+    shapes = {key: (value.shape[1:], value.dtype) for i in data_list for key, value in i.items()}
+    return {key: np.concatenate([i.get(key, np.full((n,) + shape, np.nan, dtype=dtype))
+                                 for i, n in zip(data_list, rows)])
+            for key, (shape, dtype) in shapes.items()}
+
+
+## compressed OUTCAR (OUTCAR.gz/.xz/.zst/.bz2) is streamed through the decompressor
+#magic bytes -> (codec, parallel decompressors tried in order, python module fallback)
+COMPRESSION = [(b'\x1f\x8b', 'gzip', [['pigz', '-dc'], ['gzip', '-dc']], gzip.open),
+               (b'\xfd7zXZ\x00', 'xz', [['xz', '-T0', '-dc']], lzma.open),
+               (b'\x28\xb5\x2f\xfd', 'zstd', [['zstd', '-T0', '-dc']], None),
+               (b'BZh', 'bzip2', [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']], bz2.open)]
+OUTCAR_NAMES = ['OUTCAR', 'OUTCAR.gz', 'OUTCAR.xz', 'OUTCAR.zst', 'OUTCAR.bz2']
+VASPRUN_NAMES = ['vasprun.xml', 'vasprun.xml.gz', 'vasprun.xml.xz', 'vasprun.xml.zst', 'vasprun.xml.bz2']
+
+
+def find_output(directory='.', names=OUTCAR_NAMES):
+    for i in names:
+        if os.path.isfile(os.path.join(directory, i)):
+            return os.path.join(directory, i)
+    raise FileNotFoundError(f'No {names[0]} in {directory}')
+
+
+def compression(file):
+    #codec name of an open binary file from its magic bytes, None if plain
+    magic = file.read(6)
+    file.seek(0)
+    for key, codec, commands, module in COMPRESSION:
+        if magic.startswith(key):
+            return codec
+    return None
+
+
+@contextlib.contextmanager
+def open_outcar(file_name='OUTCAR'):
+    """Binary stream of OUTCAR, decompressed on the fly if it is compressed.
+
+    A (multithreaded where the codec allows) external decompressor writes
+    into a pipe, so decompression runs alongside the parsing and nothing is
+    written to disk; the python modules are the fallback. A damaged or
+    truncated archive raises OSError once it has been read to its end.
+    """
+    file = open(file_name, 'rb')
+    codec = compression(file)
+    if codec is None:
+        with file:
+            yield file
+        return
+    file.close()
+    key, codec, commands, module = [i for i in COMPRESSION if i[1] == codec][0]
+    command = next((i for i in commands if shutil.which(i[0])), None)
+    if command is not None:
+        #the message of the tool goes into the error, not to the terminal
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command + [file_name], stdout=subprocess.PIPE, stderr=stderr, bufsize=CHUNK_SIZE)
+            try:
+                yield process.stdout
+            finally:
+                #the reader may stop early (header only), do not wait on a full pipe;
+                #once the pipe is at its end the exit status of the tool counts
+                os.set_blocking(process.stdout.fileno(), False)
+                try:
+                    at_end = process.stdout.read(1) == b''
+                except BlockingIOError:
+                    at_end = False
+                if not at_end:
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+            if process.returncode > 0:
+                stderr.seek(0)
+                message = ' '.join(stderr.read().decode(errors='replace').split())
+                raise OSError(f'{command[0]} failed to decompress {file_name}' + (f': {message}' if message else ''))
+        return
+    try:
+        if codec == 'zstd':
+            import zstandard
+            with open(file_name, 'rb') as file:
+                with zstandard.ZstdDecompressor().stream_reader(file) as stream:
+                    yield stream
+        else:
+            with module(file_name, 'rb') as stream:
+                yield stream
+    except (EOFError, zlib.error, lzma.LZMAError) as error:
+        raise OSError(f'{codec} failed to decompress {file_name}: {error}') from error
+
+
+## sidecar cache of the closed ionic steps, keyed by the OUTCAR identity
+def cache_name(file_name):
+    return f'{file_name}.conv_cache.npz'
+
+
+def _file_digest(file, offset, size=4096):
+    #digest of the header (run date) and of the bytes before offset,
+    #catches a job restarted into the same file
+    digest = hashlib.sha1()
+    file.seek(0)
+    digest.update(file.read(min(offset, size)))
+    file.seek(max(offset - size, 0))
+    digest.update(file.read(min(offset, size)))
+    return digest.hexdigest()
+
+
+def load_cache(file_name, file, exact=False, dtype=np.float64):
+    """Return (data, parser) resuming after the cached steps, or None.
+
+    The cache is used only if it belongs to the same file (device, inode),
+    the file did not shrink and the bytes before the cached offset are
+    unchanged, i.e. OUTCAR has only been appended to since. With ``exact``
+    (compressed files, which cannot be resumed) size and mtime must match.
+    A cache written in another precision of positions & forces is not used.
+    """
+    try:
+        with np.load(cache_name(file_name)) as cache:
+            index = json.loads(str(cache['index']))
+            data = {key: cache[key] for key in cache.files if key != 'index'}
+    except (OSError, ValueError, KeyError):
+        return None
+    stat = os.fstat(file.fileno())
+    if (index.get('version') != CACHE_VERSION or index.get('dtype', 'float64') != np.dtype(dtype).name or
+            index['dev'] != stat.st_dev or index['inode'] != stat.st_ino or stat.st_size < index['size']):
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (index['size'], index['mtime']):
+        if exact or _file_digest(file, index['offset']) != index['digest']:
+            return None
+    return data, OutcarParser(index['offset'], index['ediffg'], dtype)
+
+
+def save_cache(file_name, file, data, parser):
+    stat = os.fstat(file.fileno())
+    index = {'version': CACHE_VERSION, 'dev': stat.st_dev, 'inode': stat.st_ino,
+             'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+             'offset': parser.step_offset, 'ediffg': parser.ediffg, 'dtype': np.dtype(parser.dtype).name,
+             'digest': _file_digest(file, parser.step_offset)}
+    tmp_name = f'{cache_name(file_name)}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_name, 'wb') as tmp:
+            np.savez(tmp, index=json.dumps(index), **data)
+        os.replace(tmp_name, cache_name(file_name))
+    except OSError:
+        #read-only job directory: simply run without cache
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def parse_outcar(file_name='OUTCAR', chunk_size=CHUNK_SIZE, cache=True, dtype=np.float64):
+    with open(file_name, 'rb') as file:
+        codec = compression(file)
+        cached = load_cache(file_name, file, codec is not None, dtype) if cache else None
+        data, parser = cached if cached else ({}, OutcarParser(dtype=dtype))
+        if codec is None or not cached:
+            file.seek(parser.offset)
+            steps = []
+            with open_outcar(file_name) if codec else contextlib.nullcontext(file) as stream:
+                for chunk in iter(lambda: stream.read(chunk_size), b''):
+                    steps.extend(parser.feed(chunk))
+            #only closed steps are cached, the pending tail is parsed again next
+            #time; a compressed file is not appended to, its cache holds all steps
+            if codec:
+                steps.extend(parser.close())
+            data = concat_data(data, stack_steps(steps))
+            if cache and (steps or not cached):
+                save_cache(file_name, file, data, parser)
+    data = concat_data(data, stack_steps(parser.close()))
+    data['ediffg'] = parser.ediffg
+    return data
+
+
+## only the ends of OUTCAR: EDIFFG in the header, the last step at the tail
+def read_ediffg(file_name='OUTCAR', chunk_size=1 << 20):
+    parser = OutcarParser()
+    with open_outcar(file_name) as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            parser.feed(chunk)
+            if parser.ediffg is not None or 'forces' in parser._step:
+                break
+    return parser.ediffg
+
+
+def read_last_step(file_name='OUTCAR', window=1 << 20, key='forces'):
+    """Return (ionic step number, last step dict) reading OUTCAR from its end.
+
+    The last step is the last one with ``key``: a complete TOTAL-FORCE block
+    by default, ``key='energy'`` also needs the energy(sigma->0) written
+    after it. The tail window is doubled until it holds that step and the
+    Iteration header before it, so the cost does not depend on the length
+    of the run. Returns (0, None) if there is no such step. A compressed
+    OUTCAR cannot be read backwards and is streamed instead.
+    """
+    with open(file_name, 'rb') as file:
+        if compression(file):
+            return _stream_last_step(file_name, key)
+        size = os.fstat(file.fileno()).st_size
+        while True:
+            window = min(window, size)
+            file.seek(size - window)
+            buf = file.read(window)
+            force = buf.rfind(b'TOTAL-FORCE (eV/Angst)')
+            while force >= 0:
+                #the last block may still be written (or lack its energy), then the one before is used
+                head = buf.rfind(b'Iteration', 0, force)
+                if head < 0 and window < size:
+                    break
+                if _block_complete(buf, force):
+                    start = buf.rfind(b'\n', 0, max(head, 0)) + 1
+                    parser = OutcarParser()
+                    steps = parser.feed(buf[start:]) + parser.close()
+                    if key in steps[0]:
+                        number = iteration_tag.search(buf, start)
+                        return int(number.group(1)) if number else len(steps), steps[0]
+                force = buf.rfind(b'TOTAL-FORCE (eV/Angst)', 0, force)
+            if force < 0 and window == size:
+                return 0, None
+            window *= 2
+
+
+def read_final_energy(file_name='OUTCAR', window=1 << 20):
+    #energy(sigma->0) of the last complete ionic step (not of the electronic steps of a
+    #running or killed job after it), NaN if there is none
+    n_step, step = read_last_step(file_name, window, 'energy')
+    return step['energy'] if step else np.nan
+
+
+def _stream_last_step(file_name, key='forces'):
+    n_step, last = 0, (0, None)
+    parser = OutcarParser()
+    with open_outcar(file_name) as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            for step in parser.feed(chunk):
+                n_step += 1
+                last = (n_step, step) if key in step else last
+    for step in parser.close():
+        n_step += 1
+        last = (n_step, step) if key in step else last
+    return last
+
+
+def _block_complete(buf, pos):
+    head = buf.find(b'\n', pos)
+    dash = buf.find(b'\n', head + 1) if head >= 0 else -1
+    return dash >= 0 and buf.find(b'\n -', dash) >= 0
+
+
+iteration_tag = re.compile(rb'Iteration\s*(\d+)\s*\(')
+
+
+## streaming vasprun.xml backend
+def _varray(elem):
+    return np.array(' '.join(i.text for i in elem).split(), dtype=float).reshape(len(elem), -1)
+
+
+def iter_vasprun_steps(file_name='vasprun.xml', info=None):
+    """Yield one ionic step per <calculation> of vasprun.xml, like OutcarParser.feed.
+
+    The file is read with an incremental iterparse and every calculation is
+    cleared once it is read (self-consistent steps, eigenvalues and DOS as
+    soon as they end), so memory does not grow with the number of steps.
+    ``info`` receives EDIFFG, the element of every atom and the selective
+    dynamics flags. A file cut off by a running job ends after its last
+    complete step.
+    """
+    info = {} if info is None else info
+    info.setdefault('atominfo_list', [])
+    step = {}
+    stack = []
+    root = None
+    with open_outcar(file_name) as file:
+        try:
+            for event, elem in ET.iterparse(file, events=('start', 'end')):
+                if event == 'start':
+                    root = elem if root is None else root
+                    stack.append((elem.tag, elem.get('name')))
+                    continue
+                stack.pop()
+                tag, name = elem.tag, elem.get('name')
+                parent = stack[-1][0] if stack else None
+                in_calculation = ('calculation', None) in stack or tag == 'calculation'
+                if tag == 'i' and name == 'EDIFFG':
+                    info['ediffg'] = float(elem.text)
+                elif tag == 'rc' and ('array', 'atoms') in stack:
+                    info['atominfo_list'].append(elem[0].text.strip())
+                elif tag == 'varray' and name == 'selective':
+                    info['selective_list'] = [i.text.split() for i in elem]
+                elif tag == 'varray' and in_calculation:
+                    if name == 'basis':
+                        step['basis'] = _varray(elem)
+                    elif name == 'positions':
+                        #fractional in vasprun.xml, cartesian like OUTCAR
+                        step['positions'] = _varray(elem) @ step['basis']
+                    elif name == 'forces':
+                        step['forces'] = _varray(elem)
+                    elif name == 'stress':
+                        stress = _varray(elem)
+                        #OUTCAR order: XX YY ZZ XY YZ ZX
+                        step['stress'] = stress[[0, 1, 2, 0, 1, 2], [0, 1, 2, 1, 2, 0]]
+                elif tag == 'energy' and parent == 'calculation':
+                    step['energy'] = float(elem.find("i[@name='e_0_energy']").text)
+                elif tag == 'time' and name == 'totalsc':
+                    step['cpu_time'], step['real_time'] = map(float, elem.text.split())
+                elif tag in ('scstep', 'eigenvalues', 'projected', 'dos', 'dynmat'):
+                    elem.clear()
+                elif tag == 'calculation':
+                    step.pop('basis', None)
+                    if 'forces' in step:
+                        yield step
+                    step = {}
+                    #drop everything read so far from the tree
+                    root.clear()
+        except ET.ParseError:
+            pass
+
+
+def parse_vasprun(file_name='vasprun.xml'):
+    #same per-step arrays as parse_outcar, plus the atom information of the run
+    info = {}
+    data = stack_steps(list(iter_vasprun_steps(file_name, info)))
+    data['ediffg'] = info.get('ediffg')
+    atominfo_list = info['atominfo_list']
+    selective_list = info.get('selective_list', [['T', 'T', 'T']]*len(atominfo_list))
+    selective_list_array = np.array(np.array(selective_list) == 'T', dtype=int)
+    return data, (atominfo_list, selective_list, selective_list_array)
+
+
+def vasprun_complete(file_name='vasprun.xml'):
+    #VASP closes the root element only at the end of the run; a compressed
+    #vasprun.xml cannot be read from its end and is taken as a finished job
+    with open(file_name, 'rb') as file:
+        if compression(file):
+            return True
+        file.seek(max(os.fstat(file.fileno()).st_size - 4096, 0))
+        return b'</modeling>' in file.read()
+
+
+#parse rates (bytes/s) of the two backends, measured with benchmarks/benchmark.py make_outcar / make_vasprun
+#(32-300 atoms, 10-60 electronic steps): OUTCAR 50-75 MB/s, vasprun.xml 10-13 MB/s; only their ratio matters
+OUTCAR_RATE = 60e6
+VASPRUN_RATE = 12e6
+
+
+def data_size(file_name):
+    #bytes to parse: gzip keeps the uncompressed size (mod 4 GiB) in its last 4 bytes,
+    #for the other codecs the size on disk is the estimate
+    with open(file_name, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if compression(file) == 'gzip' and size >= 18:
+            file.seek(-4, os.SEEK_END)
+            return max(int.from_bytes(file.read(4), 'little'), size)
+    return size
+
+
+def cached_offset(file_name, dtype=np.float64):
+    #bytes of OUTCAR already in its sidecar cache; the whole file if the cache is up to date
+    try:
+        with np.load(cache_name(file_name)) as npz:
+            index = json.loads(str(npz['index']))
+        stat = os.stat(file_name)
+    except (OSError, ValueError, KeyError):
+        return 0
+    if (index.get('version') != CACHE_VERSION or index.get('dtype', 'float64') != np.dtype(dtype).name or
+            (index['dev'], index['inode']) != (stat.st_dev, stat.st_ino) or stat.st_size < index['size']):
+        return 0
+    if (index['size'], index['mtime']) == (stat.st_size, stat.st_mtime_ns):
+        return stat.st_size
+    return index['offset']
+
+
+def choose_source(directory='.', cache=True, dtype=np.float64):
+    """Return ('outcar' or 'vasprun', file name) of the source cheaper to parse.
+
+    An up-to-date OUTCAR cache costs nothing and wins. Otherwise the bytes
+    left to parse of each file (OUTCAR after its cached steps) are divided
+    by the parse rate of its backend. vasprun.xml is only a candidate once
+    it is complete: while the job runs it is cut off before the last ionic
+    step. On a tie vasprun.xml is taken, it needs no POSCAR.
+    """
+    found = {}
+    for source, names in [('outcar', OUTCAR_NAMES), ('vasprun', VASPRUN_NAMES)]:
+        try:
+            found[source] = find_output(directory, names)
+        except FileNotFoundError:
+            pass
+    if len(found) < 2:
+        if not found:
+            raise FileNotFoundError(f'No OUTCAR or vasprun.xml in {directory}')
+        return next(iter(found.items()))
+    offset = cached_offset(found['outcar'], dtype) if cache else 0
+    if offset == os.path.getsize(found['outcar']) or not vasprun_complete(found['vasprun']):
+        return 'outcar', found['outcar']
+    outcar_cost = (data_size(found['outcar']) - offset) / OUTCAR_RATE
+    if data_size(found['vasprun']) / VASPRUN_RATE <= outcar_cost:
+        return 'vasprun', found['vasprun']
+    return 'outcar', found['outcar']
+
+
+## POSCAR: atom information list & selective dynamics list
+def read_poscar(file_name='POSCAR'):
+    with open(file_name) as file:
+        poscar = file.readlines()
+
+    tmp_list1 = poscar[5].split()
+    tmp_list2 = list(map(int, poscar[6].split()))
+    atominfo_list = ''
+    for i in range(len(tmp_list1)):
+        atominfo_list+=(f'{tmp_list1[i]} '*tmp_list2[i])
+    atominfo_list = atominfo_list.split()
+
+    selective_list = []
+    selec_tag = re.compile(r'[TF]')
+    if poscar[7].split()[0][0] == 's' or poscar[7].split()[0][0] == 'S':
+        for i in poscar[9:9+len(atominfo_list)]:
+            selective_list.append(selec_tag.findall(i))
+    else:
+        for i in range(sum(tmp_list2)):
+            selective_list.append(['T', 'T', 'T'])
+    selective_list_array = np.array(selective_list)
+    selective_list_array[selective_list_array=='T'] = 1
+    selective_list_array[selective_list_array=='F'] = 0
+    selective_list_array = np.array(selective_list_array, dtype=int)
+    return atominfo_list, selective_list, selective_list_array
+
+
+## force statistics & per-step lists of the parsed OUTCAR data
+class Trajectory(object):
+    """Positions and forces of all ionic steps, two (steps, atoms, 3) arrays.
+
+    The force statistics are reduced over all steps at once; the masked
+    norms are computed once and reused. ``dtype=np.float32`` halves the
+    memory of long runs of large cells; arrays already in that precision
+    (``parse_outcar(..., dtype=)``) are used as they are, not copied.
+    """
+    def __init__(self, positions, forces, selective_list_array=None, dtype=np.float64):
+        self.positions = np.asarray(positions, dtype=dtype)
+        self.forces = np.asarray(forces, dtype=dtype)
+        if selective_list_array is None:
+            selective_list_array = np.ones(self.forces.shape[1:2] + (3,))
+        self.mask = np.asarray(selective_list_array, dtype=dtype)
+        #atoms fixed in x y z direction do not count in average & RMS
+        self.n_fix = int(np.count_nonzero(~self.mask.any(axis=1)))
+        self._norms = None
+
+    @classmethod
+    def from_data(cls, outcar_data, selective_list_array=None, dtype=np.float64):
+        return cls(outcar_data['positions'], outcar_data['forces'], selective_list_array, dtype)
+
+    def __len__(self):
+        return len(self.forces)
+
+    def force_norms(self):
+        #|F * mask| of every atom in every step, (steps, atoms)
+        if self._norms is None:
+            forces = self.forces
+            self._norms = np.sqrt(np.einsum('ijk,ijk,jk->ij', forces, forces, self.mask))
+        return self._norms
+
+    def max_force(self):
+        return self.force_norms().max(axis=1)
+
+    def max_force_atom(self):
+        #1-based atom sequence, the first one on ties
+        return self.force_norms().argmax(axis=1) + 1
+
+    def mean_force(self):
+        return self.force_norms().sum(axis=1) / max(self.forces.shape[1] - self.n_fix, 1)
+
+    def rms_force(self):
+        norms = self.force_norms()
+        return np.sqrt(np.einsum('ij,ij->i', norms, norms) / max(self.forces.shape[1] - self.n_fix, 1))
+
+
+def check_conv(outcar_data, selective_list_array, dtype=np.float64):
+    trajectory = Trajectory.from_data(outcar_data, selective_list_array, dtype)
+
+    #energy & other per-step lists, NaN where OUTCAR does not print them
+    step_num = len(trajectory)
+    nan_array = np.full(step_num, np.nan)
+    stress_array = outcar_data.get('stress', np.full((step_num, 6), np.nan))
+    return {'n_fix': trajectory.n_fix,
+            'ediffg': outcar_data['ediffg'],
+            'trajectory': trajectory,
+            'max_force_array': trajectory.max_force(),
+            'max_force_atom_array': trajectory.max_force_atom(),
+            'ave_force_array': trajectory.mean_force(),
+            'rms_force_array': trajectory.rms_force(),
+            'energy_array': outcar_data.get('energy', nan_array),
+            'pressure_array': stress_array[:, 0:3].mean(axis=1),
+            'magnetization_array': outcar_data.get('magnetization', nan_array),
+            'time_array': outcar_data.get('real_time', nan_array)}
+
+
+def show_conv(conv, atominfo_list, y_variable='f', plot_method='term', last_n=0):
+    if y_variable == 'f':
+        y_all = conv['max_force_array']
+        y_label = 'max_F (eV/A)'
+    elif y_variable == 'e':
+        y_all = conv['energy_array']
+        y_label = 'Energy (eV)'
+    elif y_variable == 'p':
+        y_all = conv['pressure_array']
+        y_label = 'Pressure (kB)'
+    elif y_variable == 'm':
+        y_all = conv['magnetization_array']
+        y_label = 'Magnetization (muB)'
+    elif y_variable == 't':
+        y_all = conv['time_array']
+        y_label = 'Time (s)'
+    x_all = np.arange(1, len(y_all)+1)
+    y_data = y_all[np.isfinite(y_all)][-last_n:].tolist()
+    x_data = x_all[np.isfinite(y_all)][-last_n:].tolist()
+    x_label = 'Step'
+
+    print(f"Last {len(x_data)} steps were plotted!")
+    if not x_data:
+        pass
+    elif plot_method == 'term':
+        term_plot(x_data,y_data,x_label,y_label)
+    elif plot_method == 'mp':
+        mp_plot(x_data,y_data,x_label,y_label)
+        print (f'conv-{y_label.split()[0]}.png generated by matplotlib!')
+
+    EDIFFG = conv['ediffg']
+    max_force_array = conv['max_force_array']
+    energy_array = conv['energy_array']
+    last_energy = energy_array[np.isfinite(energy_array)][-1] if np.isfinite(energy_array).any() else np.nan
+    print(f'{"="*90}')
+    if max_force_array[-1] >= abs(EDIFFG):
+        print(f'[set EDIFFG:{EDIFFG:.2e} (eV/A), not converged!]')
+    else:
+        print(f'[set EDIFFG:{EDIFFG:.2e} (eV/A), converged!]')
+    print(f'After {len(max_force_array)} ionic steps, max force converged to  {max_force_array[-1]:.6f} at atom {conv["max_force_atom_array"][-1]}, energy(sigma->0): {last_energy}.')
+    print(f'{conv["n_fix"]} of {len(atominfo_list)} atoms were fixed, average force: {conv["ave_force_array"][-1]:.6f}, RMS force: {conv["rms_force_array"][-1]:.6f}.')
+
+
+def write_log(conv, atominfo_list, selective_list, file_name='check_conv.log', last_n=0):
+    trajectory = conv['trajectory']
+    total_force_array = trajectory.force_norms()
+    max_force_array = conv['max_force_array']
+    (step_num, atom_num) = np.shape(total_force_array)
+    #atom number, element & selective flags are the same in every step, so they
+    #go into one %-template per step and only the numbers are formatted
+    atom_template = ''.join(f'{j+1:>4}{atominfo_list[j]:>4}  ' + ''.join(f'{k:3}' for k in selective_list[j]) +
+                            '% 13.7f'*6 + '% 12.7f\n' for j in range(atom_num))
+    with open(file_name, 'w', buffering=1 << 20) as log:
+        for i in range(max(step_num - last_n, 0) if last_n else 0, step_num):
+            values = np.empty((atom_num, 7))
+            values[:, 0:3] = trajectory.positions[i]
+            values[:, 3:6] = trajectory.forces[i]
+            values[:, 6] = total_force_array[i]
+            log.write(f'Ionic step: {i+1:>4}\n'
+                      '-------atom-------||---------Position x y z----------------||-------------------Force x y z total------------\n'
+                      + atom_template % tuple(values.ravel().tolist()) +
+                      '-------------------------------------------------------------------------------------------------------------\n'
+                      f'After {len(max_force_array)} ionic steps, max force converged to  {max_force_array[i]:.6f} at atom {conv["max_force_atom_array"][i]}, energy(sigma->0): {conv["energy_array"][i]}.\n'
+                      f'{conv["n_fix"]} of {len(atominfo_list)} atoms were fixed, average force: {conv["ave_force_array"][i]:.6f}, RMS force: {conv["rms_force_array"][i]:.6f}.\n'
+                      f'Pressure: {conv["pressure_array"][i]:.2f} kB, magnetization: {conv["magnetization_array"][i]:.4f}, time: {conv["time_array"][i]:.2f} s.\n\n')
+
+
+def export_conv(conv, atominfo_list, selective_list_array, file_name='check_conv.npz', last_n=0):
+    #binary counterpart of check_conv.log for downstream tools, .npz or .h5
+    trajectory = conv['trajectory']
+    steps = slice(-last_n if last_n else 0, None)
+    arrays = {'step': np.arange(1, len(trajectory)+1)[steps],
+              'positions': trajectory.positions[steps],
+              'forces': trajectory.forces[steps],
+              'force_norms': trajectory.force_norms()[steps],
+              'symbols': np.array(atominfo_list),
+              'selective': np.asarray(selective_list_array, dtype=bool)}
+    for key in ['max_force', 'max_force_atom', 'ave_force', 'rms_force', 'energy', 'pressure', 'magnetization', 'time']:
+        arrays[key] = conv[f'{key}_array'][steps]
+    if file_name.endswith(('.h5', '.hdf5')):
+        import h5py
+        with h5py.File(file_name, 'w') as h5:
+            h5.attrs['ediffg'] = conv['ediffg']
+            h5.attrs['n_fix'] = conv['n_fix']
+            for key, value in arrays.items():
+                h5.create_dataset(key, data=value.astype('S') if value.dtype.kind == 'U' else value)
+    else:
+        np.savez(file_name, ediffg=conv['ediffg'], n_fix=conv['n_fix'], **arrays)
+
+
+## follow a growing OUTCAR
+def _inotify_watch(file_name):
+    #inotify descriptor signalling writes to file_name, None where unavailable
+    #(non-Linux, or blocked); on network file systems it never fires and the
+    #select() timeout in follow_outcar falls back to plain polling
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+    except (OSError, AttributeError, TypeError):
+        return None
+    if fd < 0:
+        return None
+    in_modify, in_attrib, in_close_write = 0x002, 0x004, 0x008
+    if libc.inotify_add_watch(fd, os.fsencode(file_name), in_modify | in_attrib | in_close_write) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def follow_outcar(file_name='OUTCAR', interval=5.0, cache=True, chunk_size=CHUNK_SIZE, dtype=np.float64):
+    """Yield the parsed data each time new ionic steps are appended.
+
+    The file is kept open and only the appended bytes are fed to the same
+    parser, so a block still being written is carried until it completes.
+    The generator ends when VASP prints its final timing section; if the
+    file is replaced or truncated (job restarted) it is parsed again from
+    the start.
+    """
+    with open(file_name, 'rb') as file:
+        if compression(file):
+            #an archive does not grow
+            yield parse_outcar(file_name, chunk_size, cache, dtype)
+            return
+    watch_fd = _inotify_watch(file_name)
+    try:
+        while True:
+            with open(file_name, 'rb') as file:
+                cached = load_cache(file_name, file, dtype=dtype) if cache else None
+                data, parser = cached if cached else ({}, OutcarParser(dtype=dtype))
+                file.seek(parser.offset)
+                shown = None
+                while True:
+                    steps = []
+                    for chunk in iter(lambda: file.read(chunk_size), b''):
+                        steps.extend(parser.feed(chunk))
+                    data = concat_data(data, stack_steps(steps))
+                    pending = parser.pending()
+                    #redraw only when a step or a quantity of the pending step shows up
+                    state = (len(data.get('forces', ())), [sorted(i) for i in pending])
+                    if state != shown and ('forces' in data or pending):
+                        shown = state
+                        current = concat_data(data, stack_steps(pending))
+                        current['ediffg'] = parser.ediffg
+                        yield current
+                    if parser.finished:
+                        if cache:
+                            save_cache(file_name, file, data, parser)
+                        return
+                    if watch_fd is not None:
+                        select.select([watch_fd], [], [], interval)
+                        try:
+                            while os.read(watch_fd, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        time.sleep(interval)
+                    stat = os.stat(file_name)
+                    if stat.st_ino != os.fstat(file.fileno()).st_ino or stat.st_size < parser.offset:
+                        break
+    finally:
+        if watch_fd is not None:
+            os.close(watch_fd)
+
+
+## batch survey over many job directories
+def find_jobs(path_list, file_names=OUTCAR_NAMES):
+    #directories holding an (compressed) OUTCAR under the given trees, or listed in text files
+    jobs = []
+    for path in path_list:
+        if os.path.isfile(path):
+            with open(path) as file:
+                jobs.extend(i.strip() for i in file if i.strip() and not i.startswith('#'))
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if any(i in files for i in file_names):
+                jobs.append(root)
+    return jobs
+
+
+def survey_job(directory):
+    row = {'path': directory, 'steps': 0, 'max_force': np.nan, 'max_force_atom': 0,
+           'energy': np.nan, 'ediffg': np.nan, 'converged': False, 'error': ''}
+    try:
+        atominfo_list, selective_list, selective_list_array = read_poscar(os.path.join(directory, 'POSCAR'))
+        outcar = find_output(directory)
+        row['ediffg'] = read_ediffg(outcar)
+        row['steps'], step = read_last_step(outcar)
+        if step is None:
+            raise ValueError('no ionic step in OUTCAR')
+        outcar_data = stack_steps([step])
+        outcar_data['ediffg'] = row['ediffg']
+        conv = check_conv(outcar_data, selective_list_array)
+        row['max_force'] = float(conv['max_force_array'][-1])
+        row['max_force_atom'] = int(conv['max_force_atom_array'][-1])
+        row['energy'] = float(conv['energy_array'][-1])
+        row['converged'] = bool(row['max_force'] < abs(row['ediffg']))
+    except Exception as error:
+        #one broken or running job must not stop the survey
+        row['error'] = f'{type(error).__name__}: {error}'
+    return row
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def survey_jobs(jobs, n_worker=None):
+    n_worker = n_worker or available_cores()
+    if n_worker == 1 or len(jobs) < 2:
+        return [survey_job(i) for i in jobs]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(n_worker) as pool:
+        return list(pool.map(survey_job, jobs, chunksize=max(1, len(jobs)//(4*n_worker))))
+
+
+def write_summary(rows, file_name):
+    fields = ['path', 'steps', 'max_force', 'max_force_atom', 'energy', 'ediffg', 'converged', 'error']
+    if file_name.endswith('.json'):
+        with open(file_name, 'w') as file:
+            json.dump([{k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in i.items()}
+                       for i in rows], file, indent=1)
+    else:
+        with open(file_name, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+## NEB band: the image directories 00..NN (as written by neb_generate.py)
+def find_images(directory='.'):
+    names = sorted((i for i in os.listdir(directory) if i.isdigit() and os.path.isdir(os.path.join(directory, i))), key=int)
+    if len(names) < 3 or [int(i) for i in names] != list(range(len(names))):
+        raise ValueError(f'No NEB image directories 00..NN in {directory}')
+    return [os.path.join(directory, i) for i in names]
+
+
+def neb_image(directory, cache=True):
+    #energy & max force per ionic step of one moving image; the sidecar cache makes a repeated check parse only the new steps
+    row = {'path': directory, 'energy': np.empty(0), 'max_force': np.empty(0), 'neb_force': np.empty(0),
+           'ediffg': np.nan, 'error': ''}
+    try:
+        outcar_data = parse_outcar(find_output(directory), cache=cache)
+        if 'forces' not in outcar_data:
+            raise ValueError('no ionic step in OUTCAR')
+        poscar = os.path.join(directory, 'POSCAR')
+        selective_list_array = read_poscar(poscar)[2] if os.path.isfile(poscar) else None
+        nan_array = np.full(len(outcar_data['forces']), np.nan)
+        row['energy'] = outcar_data.get('energy', nan_array)
+        row['max_force'] = Trajectory.from_data(outcar_data, selective_list_array).max_force()
+        row['neb_force'] = outcar_data.get('neb_force', nan_array)
+        row['ediffg'] = np.nan if outcar_data['ediffg'] is None else outcar_data['ediffg']
+    except Exception as error:
+        #one damaged image must not stop the survey of the band
+        row['error'] = f'{type(error).__name__}: {error}'
+    return row
+
+
+def endpoint_energy(directory):
+    #the fixed end images only need their final energy, read from the tail; NaN without OUTCAR
+    try:
+        return read_final_energy(find_output(directory))
+    except Exception:
+        return np.nan
+
+
+def survey_band(directory='.', n_worker=None, cache=True):
+    """Parse the OUTCARs of all moving images of an NEB in parallel.
+
+    Returns the image rows of neb_image, the energies of the two end images and
+    the energy profile of every ionic step reached by all images, (steps, images).
+    """
+    images = find_images(directory)
+    moving = images[1:-1]
+    n_worker = min(n_worker or available_cores(), len(moving))
+    if n_worker == 1:
+        rows = [neb_image(i, cache) for i in moving]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(n_worker) as pool:
+            rows = list(pool.map(neb_image, moving, [cache]*len(moving)))
+    ends = [endpoint_energy(images[0]), endpoint_energy(images[-1])]
+    #the images step together; one still writing its step may be ahead of the others. A failed image is a NaN column
+    n_step = min([len(i['energy']) for i in rows if not i['error']] or [0])
+    profiles = np.column_stack([np.full(n_step, ends[0])] + [np.full(n_step, np.nan) if i['error'] else i['energy'][:n_step]
+                                                             for i in rows] + [np.full(n_step, ends[1])])
+    return {'images': images, 'rows': rows, 'ends': ends, 'profiles': profiles}
+
+
+def show_band(band, plot_method='term', last_n=0):
+    profiles = band['profiles']
+    ends = band['ends']
+    #too many profiles hide each other, the last 5 steps by default
+    shown = profiles[-(last_n or 5):]
+    #images without energy (end images without OUTCAR) are left out
+    finite = np.isfinite(shown).all(axis=0) if len(shown) else []
+    if np.count_nonzero(finite) > 1:
+        reference = ends[0] if np.isfinite(ends[0]) else shown[-1][finite].min()
+        x_data = np.arange(profiles.shape[1])[finite].tolist()
+        y_data = (shown[:, finite] - reference).tolist()
+        y_label = 'dE (eV)'
+        print(f"Energy profiles of the last {len(shown)} ionic steps were plotted, relative to image "
+              + ('00!' if np.isfinite(ends[0]) else 'of lowest energy!'))
+        if plot_method == 'term':
+            term_plot(x_data, y_data, 'Image', y_label)
+        elif plot_method == 'mp':
+            mp_plot(x_data, y_data, 'Image', y_label)
+            print (f'conv-{y_label.split()[0]}.png generated by matplotlib!')
+
+    print(f'{"="*90}')
+    print(f'{"image":>6}{"steps":>7}{"energy(sigma->0)":>19}{"E-E(00)":>11}{"max_F":>11}{"NEB_F":>11}')
+    print(f'{0:>6}{"-":>7}{ends[0]:>19.6f}{0.0 if np.isfinite(ends[0]) else np.nan:>11.4f}{"-":>11}{"-":>11}')
+    for index, row in enumerate(band['rows'], 1):
+        if row['error']:
+            print(f'{index:>6}  {row["error"]}')
+            continue
+        print(f'{index:>6}{len(row["energy"]):>7}{row["energy"][-1]:>19.6f}{row["energy"][-1]-ends[0]:>11.4f}'
+              f'{row["max_force"][-1]:>11.6f}{row["neb_force"][-1]:>11.6f}')
+    print(f'{len(band["images"])-1:>6}{"-":>7}{ends[1]:>19.6f}{ends[1]-ends[0]:>11.4f}{"-":>11}{"-":>11}')
+    print(f'{"="*90}')
+
+    rows = [i for i in band['rows'] if not i['error']]
+    if not len(profiles) or len(rows) < len(band['rows']):
+        print('Not every image has an ionic step yet!' if all('no ionic step' in i['error'] for i in band['rows'] if i['error'])
+              else f'{len(band["rows"]) - len(rows)} images could not be read!')
+        return
+    energy = profiles[-1]
+    top = int(np.nanargmax(energy[1:-1])) + 1
+    barriers = [f'{name} barrier {energy[top]-end:.4f} eV' for name, end in zip(['forward', 'reverse'], ends) if np.isfinite(end)]
+    print(f'After {len(profiles)} ionic steps, the highest image is {top:02d}' + (': ' + ', '.join(barriers) if barriers else '') + '.')
+    #VTST prints the projected NEB force, EDIFFG applies to it
+    forces = [i['neb_force'][-1] if np.isfinite(i['neb_force'][-1]) else i['max_force'][-1] for i in rows]
+    worst = int(np.argmax(forces))
+    EDIFFG = rows[0]['ediffg']
+    state = 'converged!' if max(forces) < abs(EDIFFG) else 'not converged!'
+    print(f'[set EDIFFG:{EDIFFG:.2e} (eV/A), {state}] largest force {max(forces):.6f} on image {worst+1:02d}.')
+
+
+
 def get_version():
     return '1.5 (2021.2.10, wankaiweii@gmail.com)'
 
-parser = argparse.ArgumentParser(description='Plot the convergence curve in VASP calculation.')
-
-parser.add_argument('-v', '--version', action='version', version=get_version(),help='display version')
-parser.add_argument("-y", "--y_variable", default='f', choices=['f', 'e'],
-                    help='the variable (force/energy) you want to plot [default=force]')
-parser.add_argument("-m", "--plot_method", default='term', choices=['term', 'mp'],
-                    help='plot method (in terminal/by matplotlib) you want to use [default=term]')
-parser.add_argument("-n", "--last_n", default=0, type=int,
-                    help='the number of last steps you want to plot [default=all]')
-parser.add_argument("-l", "--log_mode", action='store_true', default=False,
-                    help='generate the check_conv.log file [default=Flase]')
-args = parser.parse_args()
-
-y_variable = args.y_variable
-plot_method = args.plot_method
-last_n = args.last_n
-log_mode = args.log_mode
-
-
-#atom information list & selective dynamics list 
-with open('POSCAR') as file:
-    poscar = file.readlines()
-
-a_vector = np.array(poscar[2].split(),dtype=float)
-b_vector = np.array(poscar[3].split(),dtype=float)
-c_vector = np.array(poscar[4].split(),dtype=float)
-
-tmp_list1 = poscar[5].split()
-tmp_list2 = list(map(int, poscar[6].split()))
-atominfo_list = ''
-for i in range(len(tmp_list1)):
-    atominfo_list+=(f'{tmp_list1[i]} '*tmp_list2[i])
-atominfo_list = atominfo_list.split()
-
-selective_list = []
-selec_tag = re.compile(r'[TF]')
-if poscar[7].split()[0][0] == 's' or poscar[7].split()[0][0] == 'S':
-    for i in poscar[9:9+len(atominfo_list)]:
-        selective_list.append(selec_tag.findall(i))
-else:
-    for i in range(sum(tmp_list2)):
-        selective_list.append(['T', 'T', 'T'])
-selective_list_array = np.array(selective_list)
-selective_list_array[selective_list_array=='T'] = 1
-selective_list_array[selective_list_array=='F'] = 0
-selective_list_array = np.array(selective_list_array, dtype=int)
-
-
-with open ('OUTCAR') as file:
-    outcar = file.read()
-    
-#EDIFFG
-EDIFFG=re.findall('EDIFFG = (.*)   stopping-criterion for IOM', outcar)[0]
-EDIFFG=float(EDIFFG)
-
-#The number of atoms fixed in x y z direction
-n_fix = len([i for i in selective_list_array if all(i == np.array([0,0,0]))])
-n = np.shape(selective_list_array)[0] - n_fix
-
-#force & position list
-force_tag = re.compile(f'TOTAL-FORCE \(eV/Angst\)\n {"-"*83}\n(.*?)\n -', re.DOTALL)
-force_array = [i.split() for i in force_tag.findall(outcar)]
-force_array = np.array(force_array,dtype=float)
-dim1,dim2 = force_array.shape
-force_array = force_array[:, :, np.newaxis]
-force_array = force_array.reshape((dim1, int(dim2/6), 6))
-
-total_force_list = []
-max_force_list = []
-max_force_atom_seq_list = []
-ave_force_list = []
-for i in force_array:
-    total_f_ionic_step = [(j[0]**2 + j[1]**2 + j[2]**2)**0.5 for j in (i[:,3:6] *  selective_list_array)]
-    total_force_list.append(total_f_ionic_step)
-    
-    max_f = max(total_f_ionic_step)
-    max_force_list.append(max_f)
-    
-    max_force_atom_seq = total_f_ionic_step.index(max_f) + 1
-    max_force_atom_seq_list.append(max_force_atom_seq)
-    
-    ave_f = sum(total_f_ionic_step)/n
-    ave_force_list.append(ave_f)
-    
-    
-total_force_array = np.array(total_force_list, dtype=float)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot the convergence curve in VASP calculation.')
 
-#energy list
-energy_tag = re.compile(f'total drift.*?energy\(sigma->0\) =(.*?)\n', re.DOTALL)
-energy_array = np.array(energy_tag.findall(outcar), dtype=float)
+    parser.add_argument('-v', '--version', action='version', version=get_version(),help='display version')
+    parser.add_argument("-y", "--y_variable", default='f', choices=['f', 'e', 'p', 'm', 't'],
+                        help='the variable (force/energy/pressure/magnetization/time per step) you want to plot [default=force]')
+    parser.add_argument("-m", "--plot_method", default='term', choices=['term', 'mp'],
+                        help='plot method (in terminal/by matplotlib) you want to use [default=term]')
+    parser.add_argument("-n", "--last_n", default=0, type=int,
+                        help='the number of last steps you want to plot [default=all]')
+    parser.add_argument("-l", "--log_mode", action='store_true', default=False,
+                        help='generate the check_conv.log file, limited to --last_n steps [default=False]')
+    parser.add_argument("--log_format", default='log', choices=['log', 'npz', 'h5'],
+                        help='check_conv.log as text, or check_conv.npz / check_conv.h5 for downstream tools [default=log]')
+    parser.add_argument("-f", "--outcar", default=None,
+                        help='the OUTCAR to read, may be compressed (.gz/.xz/.zst/.bz2) [default=OUTCAR[.gz|.xz|.zst|.bz2]]')
+    parser.add_argument("-s", "--source", default='auto', choices=['auto', 'outcar', 'vasprun'],
+                        help='read OUTCAR (+POSCAR) or vasprun.xml, auto takes the cheaper one to parse (a cached OUTCAR, else by size; vasprun.xml only once complete) [default=auto]')
+    parser.add_argument("--no_cache", action='store_true', default=False,
+                        help='neither read nor write the OUTCAR.conv_cache.npz sidecar file [default=False]')
+    parser.add_argument("-F", "--follow", action='store_true', default=False,
+                        help='keep OUTCAR open and redraw whenever a new ionic step is written [default=False]')
+    parser.add_argument("-i", "--interval", default=5.0, type=float,
+                        help='polling interval of --follow in seconds [default=5]')
+    parser.add_argument("--float32", action='store_true', default=False,
+                        help='keep positions & forces in single precision, halves the memory of long runs [default=False]')
+    parser.add_argument("-b", "--batch", nargs='+', metavar='PATH',
+                        help='survey every job directory with an OUTCAR under these trees '
+                             '(or listed in these text files) instead of the current directory')
+    parser.add_argument("-o", "--output", default='conv_summary.csv',
+                        help='summary table of --batch, .csv or .json [default=conv_summary.csv]')
+    parser.add_argument("-j", "--jobs", default=0, type=int,
+                        help='worker processes of --batch and --neb [default=available cores]')
+    parser.add_argument("-N", "--neb", nargs='?', const='.', default=None, metavar='DIR',
+                        help='NEB mode: parse the OUTCARs of the images DIR/01..NN in parallel, report energy, max force '
+                             'and barrier per image and plot the energy profiles of the last --last_n (default 5) steps [default=.]')
+    parser.add_argument("--profile", nargs='?', const='vasp_plot_conv_profile.json', default=None, metavar='FILE',
+                        help='record wall/CPU time, bytes read/written and peak memory of every stage into a JSON report '
+                             '[default=vasp_plot_conv_profile.json]')
+    parser.add_argument("--cprofile", default=None, metavar='STAGE',
+                        help='also run this stage of --profile under cProfile, dumped to profile_STAGE.prof')
+    args = parser.parse_args()
 
-if y_variable == 'f':
-    y_data = max_force_list[-last_n:]
-    x_data = list(range(1,len(max_force_list)+1))[-last_n:]
-    x_label = 'Step'
-    y_label = 'max_F (eV/A)'
-elif y_variable == 'e':
-    y_data = energy_array[-last_n:]
-    x_data = list(range(1,len(energy_array)+1))[-last_n:]
-    x_label = 'Step'
-    y_label = 'Energy (eV)'
-   
-
-print(f"Last {len(x_data)} steps were plotted!")
-if plot_method == 'term':
-    term_plot(x_data,y_data,x_label,y_label)
-elif plot_method == 'mp':
-    mp_plot(x_data,y_data,x_label,y_label)
-    print (f'conv-{y_label.split()[0]}.png generated by matplotlib!')    
-print(f'{"="*90}')
-if max_force_list[-1] >= abs(EDIFFG):
-    print(f'[set EDIFFG:{EDIFFG:.2e} (eV/A), not converged!]')
-else:
-    print(f'[set EDIFFG:{EDIFFG:.2e} (eV/A), converged!]')    
-print(f'After {len(max_force_list)} ionic steps, max force converged to  {max_force_list[-1]:.6f} at atom {max_force_atom_seq_list[-1]}, energy(sigma->0): {energy_array[-1]}.')
-print(f'{n_fix} of {len(atominfo_list)} atoms were fixed, average force: {ave_force_list[-1]:.6f}.')
-
-
-(step_num, atom_num) = np.shape(total_force_array)
-with open('check_conv.log','w+') as log:
-    for i in range(step_num):
-        log.write(f'Ionic step: {i+1:>4}\n')
-        log.write('-------atom-------||---------Position x y z----------------||-------------------Force x y z total------------\n')
-        for j in range(atom_num):
-            log.write(f'{j+1:>4}{atominfo_list[j]:>4}  ')
-            [log.write(f'{k:3}') for k in selective_list[j]]
-            [log.write(f'{k: 13.7f}') for k in force_array[i][j]]
-            log.write(f'{total_force_array[i][j]: 12.7f}')
-            log.write('\n')
-        log.write('-------------------------------------------------------------------------------------------------------------\n')
-        log.write(f'After {len(max_force_list)} ionic steps, max force converged to  {max_force_list[i]:.6f} at atom {max_force_atom_seq_list[i]}, energy(sigma->0): {energy_array[i]}.\n')
-        log.write(f'{n_fix} of {len(atominfo_list)} atoms were fixed, average force: {ave_force_list[i]:.6f}.\n\n')
+    y_variable = args.y_variable
+    plot_method = args.plot_method
+    last_n = args.last_n
+    log_mode = args.log_mode
+    dtype = np.float32 if args.float32 else np.float64
+    if args.profile:
+        from stage_profile import StageProfile
+        profile = StageProfile(args.profile, args.cprofile)
+    else:
+        profile = lambda name: contextlib.nullcontext()
+
+    if args.neb:
+        try:
+            while True:
+                with profile('neb_survey'):
+                    band = survey_band(args.neb, args.jobs, cache=not args.no_cache)
+                if args.follow:
+                    print('\x1b[H\x1b[2J', end='')
+                with profile('plot'):
+                    show_band(band, plot_method, last_n)
+                if not args.follow:
+                    break
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+    elif args.batch:
+        with profile('find_jobs'):
+            jobs = find_jobs(args.batch)
+        with profile('survey'):
+            rows = survey_jobs(jobs, args.jobs)
+        with profile('write_summary'):
+            write_summary(rows, args.output)
+        n_conv = sum(i['converged'] for i in rows)
+        n_error = sum(bool(i['error']) for i in rows)
+        print(f'{len(rows)} jobs surveyed: {n_conv} converged, {len(rows)-n_conv-n_error} not converged, '
+              f'{n_error} failed. Summary written to {args.output}!')
+    elif args.follow:
+        with profile('read_poscar'):
+            atominfo_list, selective_list, selective_list_array = read_poscar('POSCAR')
+        try:
+            for outcar_data in follow_outcar(args.outcar or find_output(), args.interval, cache=not args.no_cache, dtype=dtype):
+                with profile('check_conv'):
+                    conv = check_conv(outcar_data, selective_list_array, dtype)
+                #redraw in place: cursor home & clear screen
+                print('\x1b[H\x1b[2J', end='')
+                with profile('plot'):
+                    show_conv(conv, atominfo_list, y_variable, plot_method, last_n)
+        except KeyboardInterrupt:
+            pass
+    else:
+        if args.outcar:
+            source, file_name = 'outcar', args.outcar
+        elif args.source == 'auto':
+            with profile('choose_source'):
+                source, file_name = choose_source('.', not args.no_cache, dtype)
+        else:
+            source, file_name = args.source, find_output('.', OUTCAR_NAMES if args.source == 'outcar' else VASPRUN_NAMES)
+        if source == 'vasprun':
+            with profile('parse_vasprun'):
+                outcar_data, (atominfo_list, selective_list, selective_list_array) = parse_vasprun(file_name)
+        else:
+            with profile('read_poscar'):
+                atominfo_list, selective_list, selective_list_array = read_poscar('POSCAR')
+            #every per-step quantity of OUTCAR, collected in one pass
+            with profile('parse_outcar'):
+                outcar_data = parse_outcar(file_name, cache=not args.no_cache, dtype=dtype)
+        with profile('check_conv'):
+            conv = check_conv(outcar_data, selective_list_array, dtype)
+        #the trajectory holds positions & forces from here on
+        del outcar_data
+        with profile('plot'):
+            show_conv(conv, atominfo_list, y_variable, plot_method, last_n)
+        with profile('write_log'):
+            if log_mode and args.log_format == 'log':
+                write_log(conv, atominfo_list, selective_list, 'check_conv.log', last_n)
+            elif log_mode:
+                export_conv(conv, atominfo_list, selective_list_array, f'check_conv.{args.log_format}', last_n)
+        if log_mode:
+            print(f'check_conv.{args.log_format} generated!')
+    if args.profile:
+        profile.write()